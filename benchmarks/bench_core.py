@@ -0,0 +1,290 @@
+"""
+Headless benchmarks for the ledger and daily-data hot paths (no Kivy needed).
+
+    python benchmarks/bench_core.py --sizes 1000,10000 --output bench.json
+    python benchmarks/bench_core.py --baseline old.json
+    python benchmarks/bench_core.py --sizes "" --backends "" --write-rows 1000,10000
+
+Synthetic ledgers use the real layout: a title row, an empty row, the header
+on row 3 and extra columns around 客户号/用户名/原表资产号/原表表码. Generated
+ledgers are kept in --work-dir so repeated runs skip generation.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import DATA_COLUMN_ORDER, LEDGER_HEADER_ROW, AssetDatabase, DataManager, create_data_manager  # noqa: E402
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+LEDGER_HEADER = ['换表日期', '安装人员', '安装编号', '线材使用（单根）', '序号', '客户号', '用户名',
+                 '原表资产号', '原表表码', '轮换后新表计资产号', '表计类型', '铅封号']
+
+
+def asset_number(rng):
+    return '40131' + ''.join(rng.choice('0123456789') for _ in range(7))
+
+
+def generate_ledger(path, rows, seed=0):
+    """Writes a ledger with `rows` data rows and returns its asset numbers."""
+    import openpyxl
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet('Sheet1')
+    ws.append(['东寿线#圩场公变轮换表计台账'])
+    ws.append([])
+    assert LEDGER_HEADER_ROW == 3
+    ws.append(LEDGER_HEADER)
+    assets = []
+    for i in range(rows):
+        asset = asset_number(rng); assets.append(asset)
+        ws.append([None, None, None, None, i + 1, 1442000000 + i, f'用户{i}  {rng.randint(1, 99)}',
+                   asset, rng.randint(0, 30000), None, '单相', None])
+    wb.save(path)
+    return assets
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def latency_stats(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {'count': len(samples), 'mean_us': statistics.fmean(samples) * 1e6,
+            'p50_us': pick(0.5) * 1e6, 'p95_us': pick(0.95) * 1e6, 'max_us': samples[-1] * 1e6}
+
+
+def traced_memory(fn, *args, **kwargs):
+    """Runs fn under tracemalloc; returns (result, bytes still held afterwards, peak bytes)."""
+    gc.collect(); tracemalloc.start()
+    try:
+        result = fn(*args, **kwargs)
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, retained, peak
+
+
+def bench_ledger(work_dir, rows, queries, hit_ratio, seed, memory=False):
+    path = os.path.join(work_dir, f'ledger_{rows}.xlsx')
+    assets = None
+    if not os.path.exists(path):
+        assets, generate_s = timed(generate_ledger, path, rows, seed)
+        print(f'  generated {rows} rows in {generate_s:.1f}s')
+    cache_dir = os.path.join(work_dir, f'cache_{rows}')
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    db, parse_s = timed(AssetDatabase, path)
+    _, cold_cache_s = timed(AssetDatabase, path, cache_dir=cache_dir)
+    cached_db, warm_cache_s = timed(AssetDatabase, path, cache_dir=cache_dir)
+    assert cached_db.from_cache
+    assets = assets or db.asset_numbers
+
+    # 命中的查询取台账中已有的后6位, 未命中的用随机后缀
+    rng = random.Random(seed + 1)
+    known = set(asset[-6:] for asset in assets)
+    mix = []
+    for _ in range(queries):
+        if rng.random() < hit_ratio:
+            mix.append(rng.choice(assets)[-6:])
+        else:
+            mix.append(''.join(rng.choice('0123456789') for _ in range(6)))
+    samples, hits = [], 0
+    for suffix in mix:
+        started = time.perf_counter()
+        matches = db.get_info_by_last_6_digits(suffix)
+        samples.append(time.perf_counter() - started)
+        hits += bool(matches)
+    result = {
+        'rows': rows, 'file_bytes': os.path.getsize(path), 'records': len(db.records),
+        'load_parse_s': parse_s, 'load_parse_and_cache_s': cold_cache_s, 'load_from_cache_s': warm_cache_s,
+        'lookup': dict(latency_stats(samples), hit_ratio=hits / len(mix),
+                       expected_hit_ratio=sum(s in known for s in mix) / len(mix)),
+    }
+    if memory:
+        # 从缓存加载得到的结构与解析 Excel 相同, tracemalloc 下解析会慢很多
+        del db, cached_db
+        _, retained, peak = traced_memory(AssetDatabase, path, cache_dir=cache_dir)
+        result['memory'] = {'retained_bytes': retained, 'peak_bytes': peak}
+    return result
+
+
+def bench_daily_data(work_dir, backend, records, seed):
+    output_dir = os.path.join(work_dir, f'daily_{backend}')
+    shutil.rmtree(output_dir, ignore_errors=True); os.makedirs(output_dir)
+    dm = create_data_manager(output_dir, backend=backend, output_dir=output_dir)
+    rng = random.Random(seed)
+    samples = []
+    for i in range(records):
+        record = {'客户号': str(1442000000 + i), '用户名': f'用户{i}', '原表资产号': asset_number(rng),
+                  '原表表码': str(rng.randint(0, 30000)), '新资产号': asset_number(rng), '表计类型': '单相表',
+                  '铅封号': str(230000 + i), '表箱类型': '利旧未换', '材料使用': '', '安装人员': 'bench',
+                  '备注': '', '录入时间': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        _, elapsed = timed(dm.append_data, record)
+        samples.append(elapsed)
+    dm.compact()
+    # 新建 DataManager 以测量从磁盘读取, 第二次读取走内存
+    fresh = create_data_manager(output_dir, backend=backend, output_dir=output_dir)
+    loaded, load_cold_s = timed(fresh.load_records)
+    _, load_warm_s = timed(fresh.load_records)
+    assert len(loaded) == records, (backend, len(loaded))
+    result = {
+        'backend': backend, 'records': records,
+        'append_first_s': samples[0], 'append_last_s': samples[-1],
+        'append': latency_stats(samples),
+        'load_records_cold_s': load_cold_s, 'load_records_warm_s': load_warm_s,
+    }
+    try:
+        import pandas  # noqa: F401  (load_daily_data 是可选功能)
+        _, result['load_daily_data_s'] = timed(fresh.load_daily_data)
+    except ImportError:
+        pass
+    return result
+
+
+def sample_records(count, seed):
+    rng = random.Random(seed)
+    return [{'客户号': str(1442000000 + i), '用户名': f'用户{i}', '原表资产号': asset_number(rng),
+             '原表表码': str(rng.randint(0, 30000)), '新资产号': asset_number(rng), '表计类型': '单相表',
+             '铅封号': str(230000 + i), '表箱类型': '利旧未换', '材料使用': '', '安装人员': 'bench',
+             '备注': '', '录入时间': datetime.now().strftime("%Y-%m-%d %H:%M:%S")} for i in range(count)]
+
+
+def write_with_pandas(records, path):
+    """The original save_daily_data: empty frame, concat, reindex, to_excel."""
+    import pandas as pd
+    df = pd.DataFrame(records)
+    df_to_save = pd.concat([pd.DataFrame(columns=DATA_COLUMN_ORDER), df], ignore_index=True)
+    df_to_save = df_to_save.reindex(columns=DATA_COLUMN_ORDER)
+    df_to_save.to_excel(path, index=False, engine='openpyxl')
+
+
+def write_with_workbook(records, path):
+    """The previous write_xlsx: every row in a regular (in-memory) openpyxl workbook."""
+    import openpyxl
+    wb = openpyxl.Workbook(); ws = wb.active
+    ws.append(DATA_COLUMN_ORDER)
+    for record in records:
+        ws.append([None if value == '' else value for value in (record.get(col, '') for col in DATA_COLUMN_ORDER)])
+    wb.save(path)
+
+
+def bench_xlsx_write(work_dir, rows, seed):
+    """Latency and peak memory of writing one daily file, old paths against the streaming XlsxWriter."""
+    records = sample_records(rows, seed)
+    path = os.path.join(work_dir, f'write_{rows}.xlsx')
+    writers = {'workbook': write_with_workbook, 'streaming': DataManager().write_xlsx}
+    try:
+        import pandas  # noqa: F401
+        writers = dict(pandas=write_with_pandas, **writers)
+    except ImportError:
+        pass
+    result = {'rows': rows}
+    for name, write in writers.items():
+        _, write_s = timed(write, records, path)
+        # tracemalloc 会拖慢写入, 用时和内存分两次测
+        _, _, peak = traced_memory(write, records, path)
+        result[name] = {'write_s': write_s, 'peak_bytes': peak, 'file_bytes': os.path.getsize(path)}
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    """Prints current/baseline ratios for every timing both runs share."""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    def flatten(report):
+        flat = {}
+        for section in ('ledger', 'daily_data', 'xlsx_write'):
+            for entry in report.get(section, []):
+                key = f"{section}[{entry.get('rows', entry.get('backend'))}]"
+                for name, value in entry.items():
+                    if isinstance(value, dict):
+                        for sub, subvalue in value.items():
+                            if sub.endswith(('_s', '_us', '_bytes')): flat[f'{key}.{name}.{sub}'] = subvalue
+                    elif name.endswith('_s'):
+                        flat[f'{key}.{name}'] = value
+        return flat
+    old, new = flatten(baseline), flatten(results)
+    print(f"\ncompared with {baseline_path} ({baseline['meta'].get('git_revision')}):")
+    for key in sorted(set(old) & set(new)):
+        if old[key]:
+            print(f'  {key:60s} {new[key] / old[key]:6.2f}x')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='ledger row counts, comma separated')
+    parser.add_argument('--queries', type=int, default=5000, help='lookups per ledger')
+    parser.add_argument('--hit-ratio', type=float, default=0.8, help='share of lookups that hit the ledger')
+    parser.add_argument('--records', type=int, default=500, help='records appended per daily-data backend')
+    parser.add_argument('--backends', default='xlsx,journal,sqlite')
+    parser.add_argument('--write-rows', default='1000,10000', help='daily-file sizes for the xlsx write benchmark')
+    parser.add_argument('--work-dir', default=os.path.join(tempfile.gettempdir(), 'cdgj_bench'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--baseline', help='earlier results JSON to compare against')
+    parser.add_argument('--memory', action='store_true', help='also measure ledger memory with tracemalloc')
+    args = parser.parse_args(argv)
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    import openpyxl
+    results = {
+        'meta': {'timestamp': datetime.now().isoformat(timespec='seconds'), 'git_revision': git_revision(),
+                 'python': platform.python_version(), 'openpyxl': openpyxl.__version__, 'machine': platform.platform(),
+                 'args': vars(args)},
+        'ledger': [], 'daily_data': [], 'xlsx_write': [],
+    }
+    for rows in (int(size) for size in args.sizes.split(',') if size):
+        print(f'ledger: {rows} rows')
+        entry = bench_ledger(args.work_dir, rows, args.queries, args.hit_ratio, args.seed, args.memory)
+        print(f"  parse {entry['load_parse_s']:.2f}s, cache {entry['load_from_cache_s']:.3f}s, "
+              f"lookup p95 {entry['lookup']['p95_us']:.1f}us")
+        results['ledger'].append(entry)
+    for backend in (name for name in args.backends.split(',') if name):
+        print(f'daily data: {backend}')
+        entry = bench_daily_data(args.work_dir, backend, args.records, args.seed)
+        print(f"  append #1 {entry['append_first_s'] * 1e3:.1f}ms, #{args.records} {entry['append_last_s'] * 1e3:.1f}ms, "
+              f"load {entry['load_records_cold_s'] * 1e3:.1f}ms")
+        results['daily_data'].append(entry)
+
+    for rows in (int(size) for size in args.write_rows.split(',') if size):
+        print(f'xlsx write: {rows} rows')
+        entry = bench_xlsx_write(args.work_dir, rows, args.seed)
+        for name, stats in entry.items():
+            if name == 'rows': continue
+            print(f"  {name:10s} {stats['write_s']:.2f}s, peak {stats['peak_bytes'] / 2**20:.1f} MiB")
+        results['xlsx_write'].append(entry)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f'results written to {args.output}')
+    if args.baseline: compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
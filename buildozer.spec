@@ -23,13 +23,18 @@ source.include_exts = py,png,jpg,kv,atlas,xlsx,ttc
 # 这里我们添加 'assets' 和 'fonts' 目录，以确保字体和默认Excel文件被打包
 source.include_dirs = assets, fonts
 
+# (列表) 不需要打包进APK的目录 (性能测试和导入脚本只在电脑上运行)
+source.exclude_dirs = benchmarks, tools
+
 # (字符串) 应用的版本号
 version = 1.0.0
 
 # (列表) 应用所需的Python依赖库
-# buildozer会自动通过pip下载这些库。我们添加了pandas, openpyxl和plyer
+# buildozer会自动通过pip下载这些库。我们添加了openpyxl和plyer
 # kivymd, kivy, jnius 通常会被buildozer自动包含，但明确写出更保险
-requirements = python3,plyer,cython,pyjnius,jnius,et_xmlfile,openpyxl,kivy,pandas==1.5.3,numpy==1.24.4
+# 录入流程已不依赖 pandas/numpy (见 core.py), 不再打包以减小APK体积和启动时间;
+# 如需 DataManager.load_daily_data 等可选功能, 再加回 pandas==1.5.3,numpy==1.24.4
+requirements = python3,plyer,cython,pyjnius,jnius,et_xmlfile,openpyxl,kivy
 # (字符串) 应用启动时加载的屏幕方向
 # 可选项: landscape, portrait, all
 orientation = portrait
@@ -0,0 +1,2275 @@
+"""
+Ledger lookup and daily-record storage shared by the Kivy app (main.py) and
+the headless tools. Nothing in here imports Kivy, and records are plain
+dicts: openpyxl is imported when a daily file is first read or written, and
+pandas only by load_daily_data(), which the app itself does not use.
+"""
+import os
+import bisect
+import concurrent.futures
+import copy
+import contextlib
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import pickle
+import re
+import sqlite3
+import zipfile
+from xml.etree import ElementTree
+from datetime import datetime
+import traceback
+import uuid
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+import threading
+import queue
+import random
+import time
+
+# 与 kivy.utils.platform 的判断方式相同, 但不需要导入 Kivy
+IS_ANDROID = 'ANDROID_ARGUMENT' in os.environ or 'P4A_BOOTSTRAP' in os.environ
+
+# ==================== Global Constants ====================
+REQUIRED_COLUMNS = ['客户号', '用户名', '原表资产号', '原表表码']
+LEDGER_HEADER_ROW = 3  # 台账表头所在行 (前两行为标题)
+DATA_BACKEND = 'journal'  # 'xlsx' | 'journal' | 'sqlite'
+DUPLICATE_KEY_COLUMNS = ('原表资产号', '新资产号', '铅封号')  # 这些值不应被录入两次
+DATA_COLUMN_ORDER = ['客户号', '用户名', '原表资产号', '原表表码', '新资产号', '表计类型', '铅封号', '表箱类型', '材料使用', '安装人员', '备注', '录入时间']
+RECORD_ID_COLUMN = '记录ID'  # 新增记录时分配, 之后不再改变; 统计和同步据此认出同一条记录
+STORED_COLUMNS = DATA_COLUMN_ORDER + [RECORD_ID_COLUMN]  # 日表中 记录ID 是隐藏的最后一列, 导出的表中没有
+
+# ==================== Instrumentation ====================
+# 打开后记录各操作的耗时, 写入当日数据目录下的 .metrics.jsonl (也可用环境变量 CDGJ_METRICS=1 打开)
+METRICS_ENABLED = os.environ.get('CDGJ_METRICS') == '1'
+
+class Metrics:
+    """
+    Per-operation latency histograms and counters for the hot paths. While
+    disabled, instrumented calls cost one attribute check. flush() appends the
+    stats gathered since the previous flush as one JSON line and starts over.
+    """
+    BUCKETS_MS = (0.01, 0.1, 1, 5, 10, 50, 100, 500, 1000, 5000)  # 最后一个桶收集更慢的调用
+
+    def __init__(self, enabled=False, max_bytes=1 << 20, backups=3):
+        self.enabled = enabled
+        self.path = None
+        self.max_bytes = max_bytes; self.backups = backups
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.timings = {}; self.counters = {}
+        self.since = time.time()
+
+    def set_output_dir(self, output_dir):
+        self.path = os.path.join(output_dir, '.metrics.jsonl')
+
+    def observe(self, name, seconds):
+        ms = seconds * 1000
+        with self.lock:
+            stat = self.timings.get(name)
+            if stat is None:
+                stat = self.timings[name] = {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * (len(self.BUCKETS_MS) + 1)}
+            stat['count'] += 1; stat['total_ms'] += ms
+            if ms > stat['max_ms']: stat['max_ms'] = ms
+            stat['buckets'][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timer(self, name):
+        """Context manager timing its block under `name`."""
+        return _MetricsTimer(self, name) if self.enabled else _NULL_TIMER
+
+    def percentile_ms(self, stat, q):
+        """Upper bound of the histogram bucket that holds the q-quantile."""
+        target, seen = q * stat['count'], 0
+        for bound, n in zip(self.BUCKETS_MS, stat['buckets']):
+            seen += n
+            if seen >= target: return min(bound, stat['max_ms'])
+        return stat['max_ms']
+
+    def summary(self):
+        """Human-readable lines, most total time first."""
+        with self.lock:
+            stats = sorted(self.timings.items(), key=lambda item: -item[1]['total_ms'])
+            lines = [f"{name}: {s['count']}次, 平均 {s['total_ms'] / s['count']:.1f}ms, "
+                     f"p95≤{self.percentile_ms(s, 0.95):.1f}ms, 最长 {s['max_ms']:.1f}ms" for name, s in stats]
+            lines += [f"{name}: {n}" for name, n in sorted(self.counters.items())]
+        return lines
+
+    def flush(self):
+        if not self.enabled or not self.path: return
+        with self.lock:
+            if not self.timings and not self.counters: return
+            entry = {'since': datetime.fromtimestamp(self.since).isoformat(timespec='seconds'),
+                     'until': datetime.now().isoformat(timespec='seconds'),
+                     'bucket_bounds_ms': list(self.BUCKETS_MS), 'timings': self.timings, 'counters': self.counters}
+            self.reset()
+        self.rotate()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def rotate(self):
+        """Keeps the file under max_bytes: .metrics.jsonl -> .1 -> .2 ... up to `backups`."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes: return
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.path}.{i}'): os.replace(f'{self.path}.{i}', f'{self.path}.{i + 1}')
+        os.replace(self.path, f'{self.path}.1')
+
+class _MetricsTimer:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics; self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+
+_NULL_TIMER = contextlib.nullcontext()
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+def instrumented(name):
+    """Decorator timing every call under `name` while metrics are enabled."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled: return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+# ==================== Duplicate Index ====================
+class DuplicateIndex:
+    """
+    Hash indexes of DUPLICATE_KEY_COLUMNS: value counts for today's records, and
+    value -> days for the earlier 录入结果_*.xlsx files. The history is persisted
+    per file together with its size and mtime, so a restart only rereads the
+    files that changed.
+    """
+    FILE_NAME = '.录入结果_查重索引.json'
+    VERSION = 1
+
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, self.FILE_NAME)
+        self.today = {col: {} for col in DUPLICATE_KEY_COLUMNS}
+        # {col: {value: [day, ...]}}, built by load_history for the daily file in history_for
+        self.history = None; self.history_for = None
+        self.build_lock = threading.Lock()
+
+    @staticmethod
+    def keys(record):
+        """Yields the (column, value) pairs of a record that take part in duplicate checks."""
+        for col in DUPLICATE_KEY_COLUMNS:
+            value = str(record.get(col) or '').strip()
+            if value: yield col, value
+
+    def reset_today(self, records):
+        self.today = {col: {} for col in DUPLICATE_KEY_COLUMNS}
+        for record in records: self.add(record)
+
+    def add(self, record):
+        for col, value in self.keys(record):
+            counts = self.today[col]
+            counts[value] = counts.get(value, 0) + 1
+
+    def remove(self, record):
+        for col, value in self.keys(record):
+            counts = self.today[col]
+            if counts.get(value, 0) > 1: counts[value] -= 1
+            else: counts.pop(value, None)
+
+    def ensure_history(self, today_file, read_file):
+        """
+        load_history() unless the history for today_file is already built. A caller
+        that arrives while another thread builds it waits for that build instead
+        of starting a second one.
+        """
+        if self.history_for == today_file: return
+        with self.build_lock:
+            if self.history_for != today_file: self.load_history(today_file, read_file)
+
+    @instrumented('daily.duplicate_history')
+    def load_history(self, today_file, read_file):
+        """
+        Builds the history from every 录入结果_*.xlsx next to today_file, except
+        today_file itself. Files whose size and mtime match the persisted index
+        are not read again; the others are read with read_file(path).
+        """
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                saved = json.load(f)
+            files = saved['files'] if saved.get('version') == self.VERSION else {}
+        except (OSError, ValueError, KeyError, AttributeError):
+            files = {}
+        output_dir = os.path.dirname(today_file)
+        current, changed = {}, False
+        for name in sorted(os.listdir(output_dir)):
+            path = os.path.join(output_dir, name)
+            if not (name.startswith('录入结果_') and name.endswith('.xlsx')) or path == today_file: continue
+            stat = os.stat(path)
+            fingerprint = [stat.st_size, stat.st_mtime_ns]
+            entry = files.get(name)
+            if entry is None or entry.get('fingerprint') != fingerprint:
+                try:
+                    records = read_file(path)
+                except Exception:
+                    traceback.print_exc(); continue
+                values = {col: set() for col in DUPLICATE_KEY_COLUMNS}
+                for record in records:
+                    for col, value in self.keys(record): values[col].add(value)
+                entry = {'fingerprint': fingerprint, 'values': {col: sorted(found) for col, found in values.items()}}
+                changed = True
+            current[name] = entry
+        if changed or current.keys() != files.keys():
+            try:
+                tmp_path = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'  # 每个线程各用一个临时文件
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': self.VERSION, 'files': current}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                traceback.print_exc()
+        history = {col: {} for col in DUPLICATE_KEY_COLUMNS}
+        for name, entry in current.items():
+            day = name[len('录入结果_'):-len('.xlsx')]
+            for col, values in entry['values'].items():
+                if col not in history: continue
+                for value in values: history[col].setdefault(value, []).append(day)
+        self.history, self.history_for = history, today_file
+
+    def find(self, record, exclude=None):
+        """
+        Returns [(column, value, places)] for the record's values that were already
+        entered; places lists '今日' and/or earlier YYYYMMDD days. When an existing
+        record is being edited, pass its stored version as exclude.
+        """
+        own = dict(self.keys(exclude)) if exclude else {}
+        found = []
+        for col, value in self.keys(record):
+            places = []
+            if self.today[col].get(value, 0) - (own.get(col) == value) > 0: places.append('今日')
+            if self.history: places.extend(self.history[col].get(value, ()))
+            if places: found.append((col, value, places))
+        return found
+
+# ==================== Xlsx Writer ====================
+class XlsxWriter:
+    """
+    Streams rows into a write-only openpyxl workbook, so memory stays flat however
+    many rows there are, and publishes the file atomically: the workbook is saved
+    to <file>.tmp, flushed to disk and renamed over the target, so an interrupted
+    write leaves the previous file intact. Use it as a context manager; leaving
+    the block with an exception discards the temp file.
+    """
+    NUMBER_COLUMNS = ('原表表码',)
+    TIME_COLUMNS = ('录入时间',)
+    TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+    def __init__(self, output_file, columns=DATA_COLUMN_ORDER, sheet='Sheet', identifier=None, hidden=()):
+        """
+        identifier is stored in the workbook properties (see DataManager.read_generation);
+        the hidden columns are written but hidden in Excel.
+        """
+        self.output_file = output_file
+        self.identifier = identifier
+        self.hidden = hidden
+        self.tmp_path = output_file + '.tmp'
+        self.columns = list(columns)
+        self.sheet = sheet
+        self.rows = 0
+
+    def __enter__(self):
+        import openpyxl
+        from openpyxl.cell import WriteOnlyCell
+        self.cell_class = WriteOnlyCell
+        self.wb = openpyxl.Workbook(write_only=True)
+        if self.identifier: self.wb.properties.identifier = self.identifier
+        self.add_sheet(self.sheet, self.columns, hidden=self.hidden)
+        return self
+
+    def add_sheet(self, name, columns, number_columns=NUMBER_COLUMNS, hidden=()):
+        """Starts another sheet with columns as its header; later rows go there."""
+        from openpyxl.utils import get_column_letter
+        self.ws = self.wb.create_sheet(name)
+        self.columns = list(columns)
+        for col in hidden: self.ws.column_dimensions[get_column_letter(self.columns.index(col) + 1)].hidden = True
+        self.ws.append(self.columns)
+        # 每列的写法只判断一次
+        self.writers = [self.number_cell if col in number_columns else self.time_cell if col in self.TIME_COLUMNS
+                        else self.text_cell for col in self.columns]
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            with contextlib.suppress(Exception): self.ws.close()  # 结束未写完的工作表, 不再保存
+            self.discard(); return False
+        try:
+            self.wb.save(self.tmp_path)
+            with open(self.tmp_path, 'rb+') as f: os.fsync(f.fileno())
+            os.replace(self.tmp_path, self.output_file)
+        except BaseException:
+            self.discard(); raise
+        return False
+
+    def discard(self):
+        with contextlib.suppress(OSError): os.remove(self.tmp_path)
+
+    @staticmethod
+    def number(value):
+        """
+        The int or float for value, or None unless reading the cell back gives the same
+        text: openpyxl saves numbers as safe_string() ('%.16g') and reads them back as an
+        int when there is no '.' or exponent, so e.g. '12.0' and '007' stay text.
+        """
+        from openpyxl.compat import safe_string
+        try: number = int(value)
+        except ValueError:
+            try: number = float(value)
+            except ValueError: return None
+        saved = safe_string(number)
+        if not saved: return None  # nan, inf
+        read = float(saved) if '.' in saved or 'e' in saved or 'E' in saved else int(saved)
+        return number if str(read) == value else None
+
+    def text_cell(self, value):
+        # 以 '=' 开头的文字会被 openpyxl 当成公式, 明确写成文本
+        if not value.startswith('='): return value
+        cell = self.cell_class(self.ws, value); cell.data_type = 's'
+        return cell
+
+    def number_cell(self, value):
+        number = self.number(value)
+        return self.text_cell(value) if number is None else number
+
+    def time_cell(self, value):
+        try: moment = datetime.strptime(value, self.TIME_FORMAT)
+        except ValueError: return self.text_cell(value)
+        cell = self.cell_class(self.ws, moment); cell.number_format = 'yyyy-mm-dd hh:mm:ss'
+        return cell
+
+    def append(self, record):
+        """
+        Writes one record (a dict) in column order; missing keys and '' become empty
+        cells. NUMBER_COLUMNS and TIME_COLUMNS are written as numbers and dates when
+        the text reads back unchanged; everything else, asset numbers included, is text.
+        """
+        self.append_row([record.get(col, '') for col in self.columns])
+
+    def append_row(self, values):
+        """Like append(), for values already in column order."""
+        row = []
+        for value, writer in zip(values, self.writers):
+            if value is None or value == '': row.append(None); continue
+            row.append(writer(value if type(value) is str else str(value)))
+        self.ws.append(row)
+        self.rows += 1
+
+# ==================== DataManager ====================
+class DataManager:
+    """Handles all logic related to reading from and writing to the daily Excel file."""
+    def __init__(self, journal=False, compact_every=50, output_dir=None, on_error=None):
+        """
+        output_dir overrides the Downloads folder; on_error(title, message) is
+        told about read errors that load_daily_data swallows.
+        """
+        # journal 模式下每条记录先追加到日志文件, 再定期合并写入 Excel
+        self.journal = journal
+        self.output_dir = output_dir
+        self.on_error = on_error
+        self.compact_every = compact_every
+        self.pending_count = None
+        # 后台写入线程与界面线程共用同一个 DataManager
+        self.lock = threading.RLock()
+        # 当日记录的内存副本 {record_id: record}; 删除记录不会改变其它记录的 record_id
+        self.day_file = None; self.day_records = None
+        # record_id -> 记录在 Excel + 日志中的位置编号, 日志中的修改/删除按这个编号引用记录
+        self.disk_ids = {}; self.next_record_id = 0; self.next_disk_id = 0
+        self.duplicate_index = None
+        # listener(op, day, record) is called for every appended ('append'), edited
+        # ('update', the record after the change) and deleted ('delete') record
+        self.listeners = []
+        if self.journal:
+            self.compact_stale_journals()
+
+    def get_output_dir(self):
+        if self.output_dir:
+            output_dir = self.output_dir
+        elif IS_ANDROID:
+            from jnius import autoclass
+            Environment = autoclass('android.os.Environment')
+            output_dir = Environment.getExternalStoragePublicDirectory(Environment.DIRECTORY_DOWNLOADS).getAbsolutePath()
+        else:
+            output_dir = os.path.expanduser('~/Downloads')
+        
+        if not os.path.exists(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError as e:
+                if not os.path.isdir(output_dir):
+                    raise
+        return output_dir
+
+    @staticmethod
+    def today():
+        return datetime.now().strftime("%Y%m%d")
+
+    def notify(self, op, day, records):
+        for listener in self.listeners:
+            for record in records: listener(op, day, record)
+
+    def get_output_path(self, date_str=None):
+        """Generates the file path for today's data file (or the given YYYYMMDD day)."""
+        date_str = date_str or datetime.now().strftime("%Y%m%d")
+        return os.path.join(self.get_output_dir(), f'录入结果_{date_str}.xlsx')
+
+    def get_journal_path(self, output_file=None):
+        """Journal of records not yet compacted into the given daily file."""
+        output_dir, file_name = os.path.split(output_file or self.get_output_path())
+        return os.path.join(output_dir, '.' + os.path.splitext(file_name)[0] + '.journal')
+
+    @instrumented('daily.read_xlsx')
+    def read_daily_file(self, output_file):
+        """Reads a daily xlsx as a list of records with all-string values; raises on read errors."""
+        if not os.path.exists(output_file):
+            return []
+        import openpyxl
+        wb = openpyxl.load_workbook(output_file, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else '' for name in next(rows, ())]
+            records = []
+            for row in rows:
+                if all(value is None or value == '' for value in row): continue
+                # 空单元格读成 '', 其它值一律转成字符串, 避免安卓上的类型问题
+                records.append({name: '' if value is None else str(value)
+                                for name, value in itertools.zip_longest(header, row) if name})
+            return records
+        finally:
+            wb.close()
+
+    @instrumented('daily.read_journal')
+    def read_journal(self, output_file=None, journal_path=None):
+        """Returns the entries still waiting in the journal (or the given journal file), oldest first."""
+        journal_path = journal_path or self.get_journal_path(output_file)
+        if not os.path.exists(journal_path): return []
+        records = []
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue  # 写到一半被中断的最后一行
+        return records
+
+    def read_day(self, output_file):
+        """
+        Reads a daily xlsx and replays its journal. Returns ({position: record}, next position).
+        Rows of the xlsx are numbered first, then every journaled record in order;
+        journaled updates and deletes refer to records by that number.
+        """
+        records = dict(enumerate(self.read_daily_file(output_file)))
+        next_id = len(records)
+        entries = []
+        leftovers = self.journal_leftovers(output_file)
+        if leftovers:
+            # replace_day 被中断: 只重放比 Excel 中记下的 generation 更新的日志
+            merged = self.read_generation(output_file) or ''
+            for generation, path in leftovers:
+                if generation > merged: entries.extend(self.read_journal(journal_path=path))
+        entries.extend(self.read_journal(output_file))
+        for entry in entries:
+            op = entry.pop('_op', 'append')
+            if op == 'append':
+                records[next_id] = entry; next_id += 1
+            elif op == 'update':
+                record = records.get(entry.pop('_id'))
+                if record is not None: record.update(entry)
+            elif op == 'delete':
+                records.pop(entry['_id'], None)
+        # 有记录ID之前写下的记录: 按文件和写入位置给一个 ID, 下次整表写入时一并保存
+        stem = os.path.splitext(os.path.basename(output_file))[0]
+        for disk_id, record in records.items():
+            if not record.get(RECORD_ID_COLUMN): record[RECORD_ID_COLUMN] = f'{stem}-{disk_id}'
+        return records, next_id
+
+    def journal_leftovers(self, output_file):
+        """[(generation, path)] of the journals replace_day set aside for output_file, oldest first."""
+        output_dir, prefix = os.path.split(self.get_journal_path(output_file))
+        prefix += '.'
+        if not os.path.isdir(output_dir): return []
+        return sorted((name[len(prefix):], os.path.join(output_dir, name)) for name in os.listdir(output_dir) if name.startswith(prefix))
+
+    @staticmethod
+    def read_generation(output_file):
+        """The generation replace_day stored in the xlsx, or None."""
+        if not os.path.exists(output_file): return None
+        import openpyxl
+        wb = openpyxl.load_workbook(output_file, read_only=True)
+        try:
+            return wb.properties.identifier
+        finally:
+            wb.close()
+
+    def replace_day(self, output_file, records):
+        """
+        Replaces the xlsx with records, which must already include its journal, and
+        clears the journal. The journal is first renamed to <journal>.<generation>
+        and the generation is stored in the new xlsx; read_day replays a set-aside
+        journal only when the xlsx is older than it, so a crash between the steps
+        neither loses nor duplicates entries.
+        """
+        journal_path = self.get_journal_path(output_file)
+        generation = f'{time.time_ns():016x}{os.urandom(2).hex()}'  # 按字符串排序即按时间排序
+        if os.path.exists(journal_path): os.replace(journal_path, f'{journal_path}.{generation}')
+        self.write_xlsx(records, output_file, generation)
+        for _, path in self.journal_leftovers(output_file):
+            with contextlib.suppress(OSError): os.remove(path)
+        if output_file == self.get_output_path(): self.pending_count = 0
+
+    def today_records(self):
+        """Returns today's {record_id: record}; the file is read once per day and then kept in memory."""
+        output_file = self.get_output_path()
+        with self.lock:
+            if self.day_file != output_file:
+                if self.journal:
+                    # 跨天后, 前一天日志中的记录合并进前一天的 Excel; pending_count 改为按今天的日志重新计数
+                    self.compact_stale_journals()
+                    self.pending_count = None
+                records, next_id = self.read_day(output_file)
+                self.day_file, self.day_records = output_file, records
+                self.disk_ids = {record_id: record_id for record_id in records}
+                self.next_record_id = self.next_disk_id = next_id
+                if self.duplicate_index is None: self.duplicate_index = DuplicateIndex(self.get_output_dir())
+                self.duplicate_index.reset_today(records.values())
+            return self.day_records
+
+    @instrumented('daily.load')
+    def load_records(self):
+        """
+        Loads today's records as {record_id: record}, every value a string.
+        Records still in the journal come after the compacted rows. Record ids
+        stay valid when other records are deleted.
+        """
+        try:
+            with self.lock:
+                return {record_id: dict(record) for record_id, record in self.today_records().items()}
+        except Exception as e:
+            # If reading fails, report the error and return a safe, empty result.
+            if self.on_error: self.on_error("加载错误", f"读取当日数据文件时出错:\n{e}")
+            return {}
+
+    def load_daily_data(self):
+        """load_records() as an all-string DataFrame indexed by record id (imports pandas)."""
+        import pandas as pd
+        records = self.load_records()
+        if not records: return pd.DataFrame(columns=DATA_COLUMN_ORDER)
+        return pd.DataFrame(list(records.values()), index=list(records)).fillna('')
+
+    @instrumented('daily.save')
+    def save_daily_data(self, records, output_file=None):
+        """Saves the given records (dicts or a DataFrame) to today's file, replacing any journaled records."""
+        output_file = output_file or self.get_output_path()
+        if hasattr(records, 'to_dict'): records = records.fillna('').to_dict('records')
+        with self.lock:
+            # 传入的记录已包含日志中的记录, 写入 Excel 后日志即可清空
+            self.replace_day(output_file, records)
+            # 整表替换后 record_id 需要从文件重新编号
+            if output_file == self.day_file: self.day_file = None
+
+    def write_day(self, output_file, records):
+        """Writes {record_id: record} to the xlsx and clears its journal, keeping the record ids."""
+        self.replace_day(output_file, records.values())
+        if output_file == self.day_file:
+            # 记录在新文件中的位置变了, record_id 不变
+            self.disk_ids = {record_id: pos for pos, record_id in enumerate(records)}
+            self.next_disk_id = len(records)
+        
+    def write_xlsx(self, records, output_file, generation=None):
+        """
+        Streams the records to the xlsx with DATA_COLUMN_ORDER and a hidden RECORD_ID_COLUMN
+        as header (see XlsxWriter); other keys are dropped, '' becomes an empty cell. The
+        file is replaced atomically.
+        """
+        writer = XlsxWriter(output_file, STORED_COLUMNS, identifier=generation, hidden=(RECORD_ID_COLUMN,))
+        with metrics.timer('daily.to_excel'), writer:
+            for record in records: writer.append(record)
+
+    def persist(self, entries):
+        """
+        Makes a change to the in-memory day durable: one journal line per entry in
+        journal mode, a rewrite of the xlsx otherwise. If that fails the memory
+        copy is dropped, so the next read comes from disk again.
+        """
+        try:
+            if self.journal: self.append_to_journal(entries)
+            else: self.write_day(self.day_file, self.day_records)
+        except Exception:
+            self.day_file = None
+            raise
+
+    @instrumented('daily.update')
+    def update_record(self, row_id, changes):
+        """Updates the given fields of one record; row_id is the index from load_daily_data."""
+        changes = {field: str(value) for field, value in changes.items() if field != RECORD_ID_COLUMN}
+        with self.lock:
+            record = self.today_records()[row_id]
+            self.duplicate_index.remove(record); record.update(changes); self.duplicate_index.add(record)
+            self.persist([dict(changes, _op='update', _id=self.disk_ids[row_id])])
+            self.notify('update', self.today(), [record])
+
+    @instrumented('daily.delete')
+    def delete_record(self, row_id):
+        """Deletes one record; row_id is the index from load_daily_data."""
+        with self.lock:
+            record = self.today_records().pop(row_id)
+            self.duplicate_index.remove(record)
+            self.persist([{'_op': 'delete', '_id': self.disk_ids.pop(row_id)}])
+            self.notify('delete', self.today(), [record])
+
+    def prepare_duplicate_index(self):
+        """Builds today's and the history duplicate index; safe to call from a background thread."""
+        with self.lock:
+            self.today_records()
+            index, today_file = self.duplicate_index, self.day_file
+        # 历史文件在锁外读取, 不阻塞后台写入
+        index.ensure_history(today_file, self.read_daily_file)
+
+    def duplicate_index_ready(self):
+        """True when find_duplicates() will not have to read the earlier daily files first."""
+        with self.lock:
+            index, today_file = self.duplicate_index, self.get_output_path()
+            return index is not None and self.day_file == today_file and index.history_for == today_file
+
+    @instrumented('daily.find_duplicates')
+    def find_duplicates(self, record, row_id=None):
+        """
+        Returns [(column, value, places)] for the DUPLICATE_KEY_COLUMNS values of
+        record that were already entered today or on an earlier day. row_id is
+        the record being edited, which is not counted against itself.
+        """
+        self.prepare_duplicate_index()
+        with self.lock:
+            return self.duplicate_index.find(record, exclude=self.today_records().get(row_id))
+
+    def export(self):
+        """Makes sure today's xlsx is complete on disk and returns its path."""
+        self.compact()
+        return self.get_output_path()
+
+    def append_data(self, data_dict):
+        """Appends a new row of data to today's file."""
+        for key, value in data_dict.items():
+            data_dict[key] = str(value)
+        self.append_many([data_dict])
+
+    @staticmethod
+    def new_records(records):
+        """String-valued copies of records about to be added, each with a fresh RECORD_ID_COLUMN."""
+        return [dict({key: str(value) for key, value in record.items()}, **{RECORD_ID_COLUMN: uuid.uuid4().hex}) for record in records]
+
+    @instrumented('daily.append')
+    def append_many(self, records):
+        """Appends several records with a single write (one fsync / one xlsx rewrite)."""
+        records = self.new_records(records)
+        if not records: return
+        with self.lock:
+            self.add_to_day(records)
+            self.persist(records)
+            self.notify('append', self.today(), records)
+
+    def add_to_day(self, records):
+        """Adds records to the in-memory day and gives them record ids; the caller makes them durable."""
+        day = self.today_records()
+        for record in records:
+            day[self.next_record_id] = record
+            self.duplicate_index.add(record)
+            self.disk_ids[self.next_record_id] = self.next_disk_id
+            self.next_record_id += 1; self.next_disk_id += 1
+
+    @instrumented('daily.append_day')
+    def append_to_day(self, day, records):
+        """
+        Appends records to the YYYYMMDD day's file with a single xlsx write, bypassing
+        the journal; meant for bulk imports, where one rewrite beats a journal line per record.
+        """
+        records = self.new_records(records)
+        if not records: return
+        output_file = self.get_output_path(day)
+        with self.lock:
+            if output_file != self.get_output_path():
+                existing, _ = self.read_day(output_file)
+                self.write_day(output_file, dict(enumerate(list(existing.values()) + records)))
+            else:
+                self.add_to_day(records)
+                try:
+                    self.write_day(output_file, self.day_records)
+                except Exception:
+                    self.day_file = None
+                    raise
+            self.notify('append', day, records)
+
+    @instrumented('daily.journal_append')
+    def append_to_journal(self, entries):
+        """Writes entries as durable JSON lines; compacts every compact_every entries."""
+        journal_path = self.get_journal_path()
+        if self.pending_count is None:
+            self.pending_count = len(self.read_journal())
+        data = ''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries).encode('utf-8')
+        with open(journal_path, 'ab+') as f:
+            # 上次写入被中断时补一个换行, 避免新记录拼接到残缺的行上
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n': data = b'\n' + data
+            f.write(data)
+            f.flush(); os.fsync(f.fileno())
+        self.pending_count += len(entries)
+        if self.compact_every and self.pending_count >= self.compact_every:
+            self.compact()
+
+    @instrumented('daily.compact')
+    def compact(self, output_file=None):
+        """Merges journaled entries into the daily xlsx. Returns the number of entries merged."""
+        output_file = output_file or self.get_output_path()
+        with self.lock:
+            journal_entries = self.read_journal(output_file)
+            if not journal_entries and not self.journal_leftovers(output_file):
+                return 0
+            # 这里读取失败必须抛出, 否则会用空表覆盖已有的 Excel
+            if output_file == self.get_output_path():
+                records = self.today_records()
+            else:
+                records, _ = self.read_day(output_file)
+            self.write_day(output_file, records)
+        return len(journal_entries)
+
+    def compact_stale_journals(self):
+        """Compacts journals (and set-aside journals) left behind by previous days (e.g. the app was killed)."""
+        today_file = self.get_output_path()
+        output_dir = self.get_output_dir()
+        day_files = {os.path.join(output_dir, name[1:name.index('.journal')] + '.xlsx')
+                     for name in os.listdir(output_dir) if name.startswith('.录入结果_') and '.journal' in name}
+        for day_file in sorted(day_files - {today_file}):
+            try:
+                self.compact(day_file)
+            except Exception:
+                traceback.print_exc()
+
+# ==================== SQLite Storage ====================
+class SQLiteDataManager(DataManager):
+    """
+    Keeps the daily records in a SQLite database (one row per record, keyed by
+    a stable row id). The 录入结果_YYYYMMDD.xlsx files are only written by export().
+    """
+    def __init__(self, db_path, output_dir=None, on_error=None):
+        super().__init__(journal=False, output_dir=output_dir, on_error=on_error)
+        self.db_path = db_path
+        db_dir = os.path.dirname(db_path)
+        if db_dir: os.makedirs(db_dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        columns = ', '.join(f'"{col}" TEXT NOT NULL DEFAULT \'\'' for col in STORED_COLUMNS)
+        with self.conn:
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS records (id INTEGER PRIMARY KEY AUTOINCREMENT, day TEXT NOT NULL, {columns})')
+            existing = {row[1] for row in self.conn.execute('PRAGMA table_info(records)')}
+            for col in STORED_COLUMNS:
+                if col not in existing: self.conn.execute(f'ALTER TABLE records ADD COLUMN "{col}" TEXT NOT NULL DEFAULT \'\'')
+            if RECORD_ID_COLUMN not in existing:
+                # 有记录ID之前的数据库: 每条旧记录补一个
+                self.conn.execute(f'UPDATE records SET "{RECORD_ID_COLUMN}" = lower(hex(randomblob(16)))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_records_day ON records (day)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_records_old_asset ON records ("原表资产号")')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_records_new_asset ON records ("新资产号")')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_records_seal ON records ("铅封号")')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS imported_days (day TEXT PRIMARY KEY)')
+            # 改动过但 Excel 尚未重写的日期; 与改动在同一事务中写入, 应用被杀掉后也不会丢
+            self.conn.execute('CREATE TABLE IF NOT EXISTS dirty_days (day TEXT PRIMARY KEY)')
+        self.compact_stale_journals()
+
+    def ensure_day_imported(self, day):
+        """Imports an xlsx written before the SQLite backend was enabled, once per day."""
+        if self.conn.execute('SELECT 1 FROM imported_days WHERE day = ?', (day,)).fetchone(): return
+        output_file = self.get_output_path(day)
+        records = self.read_daily_file(output_file)
+        with self.conn:
+            if records: self.insert_rows(day, records)
+            self.conn.execute('INSERT INTO imported_days (day) VALUES (?)', (day,))
+
+    INSERT_SQL = 'INSERT INTO records (day, {}) VALUES ({})'.format(
+        ', '.join(f'"{col}"' for col in STORED_COLUMNS), ', '.join('?' * (len(STORED_COLUMNS) + 1)))
+
+    def insert_rows(self, day, rows):
+        """Inserts rows; one without a RECORD_ID_COLUMN (e.g. from an old xlsx) gets a fresh one."""
+        def values(row):
+            values = {col: str(row.get(col, '')) for col in STORED_COLUMNS}
+            values[RECORD_ID_COLUMN] = values[RECORD_ID_COLUMN] or uuid.uuid4().hex
+            return [day] + list(values.values())
+        self.conn.executemany(self.INSERT_SQL, map(values, rows))
+        self.mark_dirty(day)
+
+    def mark_dirty(self, day):
+        """Notes that the day's xlsx is behind; call it inside the transaction that changes the day."""
+        self.conn.execute('INSERT OR IGNORE INTO dirty_days (day) VALUES (?)', (day,))
+
+    def dirty_days(self):
+        return [row[0] for row in self.conn.execute('SELECT day FROM dirty_days ORDER BY day')]
+
+    @instrumented('daily.load')
+    def load_records(self, day=None):
+        """Returns the day's records as {row id: record}, every value a string."""
+        day = day or self.today()
+        quoted = ', '.join(f'"{col}"' for col in STORED_COLUMNS)
+        with self.lock:
+            self.ensure_day_imported(day)
+            rows = self.conn.execute(f'SELECT id, {quoted} FROM records WHERE day = ? ORDER BY id', (day,)).fetchall()
+        return {row[0]: dict(zip(STORED_COLUMNS, row[1:])) for row in rows}
+
+    @instrumented('daily.save')
+    def save_daily_data(self, records, output_file=None):
+        """Replaces today's records with the given records (dicts or a DataFrame)."""
+        day = self.today()
+        if hasattr(records, 'to_dict'): records = records.fillna('').to_dict('records')
+        with self.lock:
+            self.ensure_day_imported(day)
+            with self.conn:
+                self.conn.execute('DELETE FROM records WHERE day = ?', (day,))
+                self.insert_rows(day, records)
+
+    @instrumented('daily.append')
+    def append_data(self, data_dict):
+        day = self.today()
+        data_dict = self.new_records([data_dict])[0]
+        with self.lock:
+            self.ensure_day_imported(day)
+            with self.conn:
+                cursor = self.conn.execute(self.INSERT_SQL, [day] + [str(data_dict.get(col, '')) for col in STORED_COLUMNS])
+                self.mark_dirty(day)
+            self.notify('append', day, [data_dict])
+        return cursor.lastrowid
+
+    @instrumented('daily.append')
+    def append_many(self, records):
+        day = self.today()
+        records = self.new_records(records)
+        with self.lock:
+            self.ensure_day_imported(day)
+            with self.conn:
+                self.insert_rows(day, records)
+            self.notify('append', day, records)
+
+    @instrumented('daily.append_day')
+    def append_to_day(self, day, records):
+        records = self.new_records(records)
+        with self.lock:
+            self.ensure_day_imported(day)
+            with self.conn:
+                self.insert_rows(day, records)
+            self.notify('append', day, records)
+
+    @instrumented('daily.update')
+    def update_record(self, row_id, changes):
+        fields = [field for field in changes if field in DATA_COLUMN_ORDER]
+        if not fields: return
+        assignments = ', '.join(f'"{field}" = ?' for field in fields)
+        with self.lock:
+            with self.conn:
+                self.conn.execute(f'UPDATE records SET {assignments} WHERE id = ?',
+                                  [str(changes[field]) for field in fields] + [int(row_id)])
+                self.conn.execute('INSERT OR IGNORE INTO dirty_days (day) SELECT day FROM records WHERE id = ?', (int(row_id),))
+            day, record = self.fetch_record(row_id)
+            if day: self.notify('update', day, [record])
+
+    @instrumented('daily.delete')
+    def delete_record(self, row_id):
+        with self.lock:
+            day, record = self.fetch_record(row_id)
+            with self.conn:
+                self.conn.execute('DELETE FROM records WHERE id = ?', (int(row_id),))
+                if day: self.mark_dirty(day)
+            if day: self.notify('delete', day, [record])
+
+    def fetch_record(self, row_id):
+        """(day, record) of one row, or (None, None) if it does not exist."""
+        quoted = ', '.join(f'"{col}"' for col in STORED_COLUMNS)
+        row = self.conn.execute(f'SELECT day, {quoted} FROM records WHERE id = ?', (int(row_id),)).fetchone()
+        return (row[0], dict(zip(STORED_COLUMNS, row[1:]))) if row else (None, None)
+
+    def prepare_duplicate_index(self):
+        pass  # 查重直接使用表上的索引
+
+    def duplicate_index_ready(self):
+        return True
+
+    @instrumented('daily.find_duplicates')
+    def find_duplicates(self, record, row_id=None):
+        day = self.today()
+        exclude = -1 if row_id is None else int(row_id)
+        found = []
+        with self.lock:
+            self.ensure_day_imported(day)
+            for col, value in DuplicateIndex.keys(record):
+                days = {row[0] for row in self.conn.execute(f'SELECT DISTINCT day FROM records WHERE "{col}" = ? AND id != ?', (value, exclude))}
+                places = (['今日'] if day in days else []) + sorted(days - {day})
+                if places: found.append((col, value, places))
+        return found
+
+    @instrumented('daily.export')
+    def export(self, day=None):
+        """Writes the day's records to 录入结果_YYYYMMDD.xlsx in DATA_COLUMN_ORDER and returns the path."""
+        day = day or self.today()
+        output_file = self.get_output_path(day)
+        with self.lock:
+            self.write_xlsx(self.load_records(day).values(), output_file)
+            with self.conn:
+                self.conn.execute('DELETE FROM dirty_days WHERE day = ?', (day,))
+        return output_file
+
+    def compact(self, output_file=None):
+        """Exports every day changed since its last export, in this session or an earlier one."""
+        with self.lock:
+            days = self.dirty_days()
+            for day in days:
+                self.export(day)
+        return len(days)
+
+    def compact_stale_journals(self):
+        """Exports the earlier days a previous session changed but never exported (e.g. the app was killed)."""
+        with self.lock:
+            for day in self.dirty_days():
+                if day == self.today(): continue
+                try:
+                    self.export(day)
+                except Exception:
+                    traceback.print_exc()
+
+def create_data_manager(data_dir, backend=DATA_BACKEND, output_dir=None, on_error=None):
+    """Builds the DataManager for the configured DATA_BACKEND."""
+    if backend == 'sqlite':
+        return SQLiteDataManager(os.path.join(data_dir, 'records.sqlite3'), output_dir=output_dir, on_error=on_error)
+    return DataManager(journal=backend == 'journal', output_dir=output_dir, on_error=on_error)
+
+# ==================== Daily Archive ====================
+class DailyArchive:
+    """
+    Index of the 录入结果_YYYYMMDD.xlsx files in the DataManager's output folder.
+    Each file is parsed once; its rows and a summary are cached on disk keyed by
+    size and mtime, so queries and monthly exports only reread changed files.
+    Today's records always come from the DataManager itself.
+    """
+    VERSION = 3
+    FILE_PATTERN = re.compile(r'录入结果_(\d{8})\.xlsx$')
+    SUMMARY_COLUMNS = ('安装人员', '表计类型', '表箱类型')
+
+    def __init__(self, data_manager, cache_dir):
+        self.data_manager = data_manager
+        self.cache_dir = cache_dir
+        self.lock = threading.RLock()
+        # day -> (path, (size, mtime)) of the files found by refresh(), and their summaries
+        self.files = {}; self.summaries = {}
+
+    @staticmethod
+    def today():
+        return datetime.now().strftime("%Y%m%d")
+
+    def cache_path(self, day):
+        return os.path.join(self.cache_dir, f'archive_{day}.pickle')
+
+    @classmethod
+    def summarize(cls, rows):
+        """{'count': n, column: {value: count}} for SUMMARY_COLUMNS."""
+        summary = {'count': len(rows)}
+        for col in cls.SUMMARY_COLUMNS:
+            slot, counts = DATA_COLUMN_ORDER.index(col), {}
+            for row in rows: counts[row[slot]] = counts.get(row[slot], 0) + 1
+            summary[col] = counts
+        return summary
+
+    @instrumented('archive.refresh')
+    def refresh(self):
+        """Finds the daily files and parses the new or changed ones. Returns all days, today last."""
+        output_dir = self.data_manager.get_output_dir()
+        today = self.today()
+        files = {}
+        for name in os.listdir(output_dir):
+            match = self.FILE_PATTERN.match(name)
+            if not match or match.group(1) == today: continue
+            path = os.path.join(output_dir, name)
+            stat = os.stat(path)
+            files[match.group(1)] = (path, (stat.st_size, stat.st_mtime_ns))
+        with self.lock:
+            for day, entry in files.items():
+                if day not in self.summaries or self.files.get(day) != entry:
+                    self.summaries[day] = self.load_day(day, *entry)[1]
+            for day in set(self.summaries) - set(files): del self.summaries[day]
+            self.files = files
+        return self.days()
+
+    def load_day(self, day, path, fingerprint):
+        """Returns (rows, summary) of a past day from the cache, parsing the file when it changed."""
+        try:
+            with open(self.cache_path(day), 'rb') as f:
+                cached = pickle.load(f)
+            if cached['version'] == self.VERSION and cached['fingerprint'] == fingerprint:
+                metrics.count('archive.cache_hit')
+                return cached['rows'], cached['summary']
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError, TypeError, AttributeError):
+            pass
+        metrics.count('archive.cache_miss')
+        rows = [tuple(record.get(col, '') for col in DATA_COLUMN_ORDER) for record in self.data_manager.read_daily_file(path)]
+        summary = self.summarize(rows)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = self.cache_path(day) + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': self.VERSION, 'fingerprint': fingerprint, 'rows': rows, 'summary': summary},
+                            f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path(day))
+        except OSError:
+            traceback.print_exc()
+        return rows, summary
+
+    def days(self, start=None, end=None):
+        """Days known since the last refresh() within [start, end] (YYYYMMDD strings), oldest first."""
+        with self.lock:
+            days = sorted(self.files) + [self.today()]
+        return [day for day in days if (start is None or day >= start) and (end is None or day <= end)]
+
+    def rows(self, day):
+        """The day's records as tuples in DATA_COLUMN_ORDER."""
+        if day == self.today():
+            return [tuple(record.get(col, '') for col in DATA_COLUMN_ORDER) for record in self.data_manager.load_records().values()]
+        with self.lock:
+            return self.load_day(day, *self.files[day])[0]
+
+    def summary(self, day):
+        if day == self.today(): return self.summarize(self.rows(day))
+        with self.lock:
+            return self.summaries[day]
+
+    @staticmethod
+    def matches(col, value, wanted):
+        # 安装人员 可能是多人合写的一个字符串, 按包含匹配
+        return wanted in value if col == '安装人员' else value == wanted
+
+    @instrumented('archive.query')
+    def query(self, start=None, end=None, installer=None, meter_type=None, box_type=None):
+        """
+        Yields (day, record) for the records between start and end matching every
+        given filter. Days whose summary rules out a filter are skipped unread.
+        """
+        filters = [(col, DATA_COLUMN_ORDER.index(col), wanted)
+                   for col, wanted in zip(self.SUMMARY_COLUMNS, (installer, meter_type, box_type)) if wanted]
+        for day in self.days(start, end):
+            summary = self.summary(day)
+            if not all(any(self.matches(col, value, wanted) for value in summary[col]) for col, _, wanted in filters):
+                continue
+            for row in self.rows(day):
+                if all(self.matches(col, row[slot], wanted) for col, slot, wanted in filters):
+                    yield day, dict(zip(DATA_COLUMN_ORDER, row))
+
+    @instrumented('archive.export_month')
+    def export_month(self, month=None, output_file=None):
+        """
+        Writes every record of the month (YYYYMM, the current month by default) to
+        录入汇总_YYYYMM.xlsx with a per-day count sheet. Rows are streamed one day at
+        a time through an XlsxWriter, so memory does not grow with the month and
+        cells are written as in the daily files. Returns (path, number of records).
+        """
+        month = month or self.today()[:6]
+        output_file = output_file or os.path.join(self.data_manager.get_output_dir(), f'录入汇总_{month}.xlsx')
+        days = self.days(month + '01', month + '31')
+        totals, count = [], 0
+        with XlsxWriter(output_file, ['日期'] + DATA_COLUMN_ORDER, sheet='汇总') as writer:
+            for day in days:
+                rows = self.rows(day)
+                for row in rows: writer.append_row((day,) + tuple(row))
+                totals.append((day, len(rows)))
+                count += len(rows)
+            writer.add_sheet('按日统计', ['日期', '条数'], number_columns=('条数',))
+            for day, n in totals + [('合计', count)]: writer.append_row((day, n))
+        return output_file, count
+
+# ==================== Daily Statistics ====================
+class DailyStats:
+    """
+    Running counts of today's records: the total, per 表计类型, per 表箱类型 and per
+    hour of 录入时间. The day is read from the DataManager once; after that the
+    counts follow its append/update/delete notifications at O(1) each, so
+    reading them needs no I/O. on_change() is called, from the writing thread,
+    after every change.
+    """
+    COLUMNS = ('表计类型', '表箱类型')
+
+    def __init__(self, data_manager, on_change=None):
+        self.data_manager = data_manager
+        self.on_change = on_change
+        self.lock = threading.RLock()
+        with data_manager.lock:
+            self.reset(data_manager.today(), data_manager.load_records().values())
+            data_manager.listeners.append(self)
+
+    @staticmethod
+    def key(record):
+        # 记录ID 不可修改, 修改记录时据此找到它原来的分类
+        return record.get(RECORD_ID_COLUMN, '')
+
+    @staticmethod
+    def hour(record):
+        """'HH' of 录入时间 ('YYYY-MM-DD HH:MM:SS'), '' when it has none."""
+        hour = str(record.get('录入时间', ''))[11:13]
+        return hour if hour.isdigit() else ''
+
+    def reset(self, day, records):
+        with self.lock:
+            self.day, self.count = day, 0
+            self.counts = {col: {} for col in self.COLUMNS}; self.hours = {}
+            self.categories = {}  # key(record) -> (表计类型, 表箱类型)
+            for record in records: self.append(record)
+
+    def __call__(self, op, day, record):
+        with self.lock:
+            if day != self.day:
+                if day < self.day: return  # 导入到以前日期的记录
+                # 跨天后第一次变化: 变化已经写入, 从存储重新统计新的一天
+                self.reset(day, self.data_manager.load_records().values())
+            else:
+                getattr(self, op)(record)
+        if self.on_change: self.on_change()
+
+    @staticmethod
+    def bump(counts, value, step):
+        n = counts.get(value, 0) + step
+        if n > 0: counts[value] = n
+        else: counts.pop(value, None)
+
+    def bump_categories(self, categories, step):
+        for col, value in zip(self.COLUMNS, categories): self.bump(self.counts[col], value, step)
+
+    def append(self, record):
+        categories = tuple(record.get(col, '') for col in self.COLUMNS)
+        self.categories[self.key(record)] = categories
+        self.count += 1
+        self.bump_categories(categories, 1); self.bump(self.hours, self.hour(record), 1)
+
+    def update(self, record):
+        categories = tuple(record.get(col, '') for col in self.COLUMNS)
+        old = self.categories.get(self.key(record))
+        if old is not None and old != categories:
+            self.bump_categories(old, -1); self.bump_categories(categories, 1)
+        self.categories[self.key(record)] = categories
+
+    def delete(self, record):
+        self.categories.pop(self.key(record), None)
+        self.count -= 1
+        self.bump_categories(tuple(record.get(col, '') for col in self.COLUMNS), -1); self.bump(self.hours, self.hour(record), -1)
+
+    def snapshot(self):
+        """
+        {'day': YYYYMMDD, 'count': n, '表计类型': {value: n}, '表箱类型': {value: n},
+        'hours': {'HH': n}} as copies. The first call on a new day reads that day once.
+        """
+        if self.day != self.data_manager.today():
+            with self.data_manager.lock:
+                self.reset(self.data_manager.today(), self.data_manager.load_records().values())
+        with self.lock:
+            snapshot = {'day': self.day, 'count': self.count, 'hours': dict(sorted(self.hours.items()))}
+            for col, counts in self.counts.items(): snapshot[col] = dict(counts)
+            return snapshot
+
+# ==================== Validation ====================
+# 录入数据的格式 (正则, 须整体匹配); 数据目录下的 validation_rules.json 可修改或增加规则, 规则写成 "" 即关闭
+VALIDATION_RULES = {
+    '原表资产号': r'\d{8,24}',
+    '新资产号': r'\d{8,24}',
+    '铅封号': r'[0-9A-Za-z-]{4,20}',
+    '原表表码': r'\d+(\.\d+)?',
+}
+
+class RecordValidator:
+    """
+    Checks many records in one pass, column by column: the format rules, the
+    ledger cross-reference through the AssetDatabase index (原表资产号 present,
+    same 客户号), the entered 原表表码 against the ledger reading, and
+    DUPLICATE_KEY_COLUMNS values that occur more than once among the checked
+    rows. Each distinct value is matched and looked up only once.
+    """
+    RULES_FILE = 'validation_rules.json'
+    MAX_READING_GAIN = 20000  # 原表表码 比台账读数多出这么多时视为可疑
+
+    def __init__(self, asset_db=None, rules=None, max_reading_gain=MAX_READING_GAIN):
+        self.asset_db = asset_db
+        rules = dict(VALIDATION_RULES, **(rules or {}))
+        self.rules = {col: re.compile(pattern) for col, pattern in rules.items() if pattern}
+        self.max_reading_gain = max_reading_gain
+
+    @classmethod
+    def load_rules(cls, directory):
+        """{column: regex} from directory/validation_rules.json, or {} when there is none."""
+        try:
+            with open(os.path.join(directory, cls.RULES_FILE), encoding='utf-8') as f:
+                rules = json.load(f)
+            return {str(col): str(pattern or '') for col, pattern in rules.items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError):
+            traceback.print_exc(); return {}
+
+    @staticmethod
+    def number(value):
+        try: return float(str(value).strip())
+        except ValueError: return None
+
+    def columns_needed(self):
+        return list(dict.fromkeys(list(self.rules) + list(DUPLICATE_KEY_COLUMNS) + ['客户号', '原表表码']))
+
+    def validate(self, records, counts=None):
+        """
+        records is {key: record}; returns {key: [problem, ...]} for the records with problems.
+        counts (see duplicate_counts) lets a few records be checked against a larger set.
+        """
+        keys = list(records)
+        columns = {col: [str(record.get(col, '') or '') for record in records.values()] for col in self.columns_needed()}
+        return {keys[i]: found for i, found in self.validate_columns(columns, counts).items()}
+
+    @staticmethod
+    def duplicate_counts(records):
+        """{column: Counter of values} over records for the DUPLICATE_KEY_COLUMNS."""
+        return {col: Counter(str(record.get(col, '') or '').strip() for record in records) for col in DUPLICATE_KEY_COLUMNS}
+
+    def validate_days(self, archive, start=None, end=None):
+        """
+        Validates the records of a DailyArchive range together, so duplicates across
+        days are found too. Returns {(day, row number in the day): [problem, ...]}.
+        """
+        keys, rows = [], []
+        for day in archive.days(start, end):
+            day_rows = archive.rows(day)
+            keys.extend((day, pos) for pos in range(len(day_rows))); rows.extend(day_rows)
+        # 行是按 DATA_COLUMN_ORDER 排列的元组, 直接转成列
+        columns = dict(zip(DATA_COLUMN_ORDER, map(list, zip(*rows)))) if rows else {col: [] for col in DATA_COLUMN_ORDER}
+        return {keys[i]: found for i, found in self.validate_columns(columns).items()}
+
+    @instrumented('validate.columns')
+    def validate_columns(self, columns, counts=None):
+        """
+        columns is {column: [value per row]}; returns {row number: [problem, ...]}.
+        Every check first works out the offending distinct values with set and
+        Counter operations and only then walks the rows that hold one of them.
+        Duplicates are counted among these rows unless counts is given.
+        """
+        columns = {col: [value.strip() for value in columns[col]] for col in self.columns_needed()}
+        problems = {}
+        def flag(i, message): problems.setdefault(i, []).append(message)
+        for col, pattern in self.rules.items():
+            bad = {value for value in set(columns[col]) if pattern.fullmatch(value) is None}
+            if not bad: continue
+            for i, value in enumerate(columns[col]):
+                if value in bad: flag(i, f'{col}格式不符: {value}' if value else f'{col}为空')
+        for col in DUPLICATE_KEY_COLUMNS:
+            seen = counts[col] if counts else Counter(columns[col])
+            repeated = {value for value in set(columns[col]) if value and seen[value] > 1}
+            if not repeated: continue
+            for i, value in enumerate(columns[col]):
+                if value in repeated: flag(i, f'{col}重复 {seen[value]} 次: {value}')
+        for i, (old, new) in enumerate(zip(columns['原表资产号'], columns['新资产号'])):
+            if new and new == old: flag(i, '新资产号与原表资产号相同')
+        if self.asset_db is not None: self.check_ledger(columns, flag)
+        return dict(sorted(problems.items()))
+
+    def check_ledger(self, columns, flag):
+        # 每个不同的原表资产号只查一次台账: [(客户号, 原表表码), ...]
+        ledger, store = {}, self.asset_db.records
+        for asset in set(columns['原表资产号']):
+            if not asset: continue
+            ledger[asset] = [(str(store.value('客户号', pos)).strip(), self.number(store.value('原表表码', pos)))
+                             for pos in self.asset_db.positions(asset)]
+        number, max_gain = self.number, self.max_reading_gain
+        for i, (asset, customer, reading) in enumerate(zip(columns['原表资产号'], columns['客户号'], columns['原表表码'])):
+            if not asset: continue
+            matches = ledger[asset]
+            if not matches: flag(i, '台账中没有该原表资产号'); continue
+            # 台账中同号的行不止一条时, 按客户号对应
+            expected, base = next((match for match in matches if match[0] == customer), matches[0])
+            if expected and customer and customer != expected: flag(i, f'客户号与台账不符 (台账: {expected})')
+            reading = number(reading)
+            if reading is None or base is None: continue
+            if reading < base: flag(i, f'原表表码 {reading:g} 小于台账读数 {base:g}')
+            elif reading - base > max_gain: flag(i, f'原表表码 {reading:g} 比台账读数 {base:g} 多出 {reading - base:g}')
+
+# ==================== Write-Behind Queue ====================
+class WriteBehindQueue:
+    """
+    Accepts records immediately and writes them to a DataManager on a background
+    thread. Records that arrive within `batch_window` seconds of each other are
+    written with one append_many() call. A failed batch is kept and retried with
+    the next one, so nothing is dropped.
+    """
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, data_manager, batch_window=0.3, on_written=None, on_error=None):
+        # 回调在后台线程中执行, 界面代码需要自行通过 Clock 切回主线程
+        self.data_manager = data_manager
+        self.batch_window = batch_window
+        self.on_written = on_written
+        self.on_error = on_error
+        self.queue = queue.Queue()
+        self.cond = threading.Condition()
+        self.submitted_seq = 0; self.processed_seq = 0
+        self.flush_requests = 0; self.flushes_done = 0
+        self.failed = []
+        self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+        self.thread.start()
+
+    def submit(self, record):
+        """Queues one record and returns its sequence number."""
+        with self.cond:
+            self.submitted_seq += 1
+            seq = self.submitted_seq
+        self.queue.put((seq, dict(record)))
+        return seq
+
+    def pending(self):
+        with self.cond:
+            return self.submitted_seq - self.processed_seq + len(self.failed)
+
+    def flush(self, timeout=None):
+        """Writes everything submitted so far and waits for it. Returns True if all of it was saved."""
+        if not self.thread.is_alive():
+            return self.pending() == 0
+        with self.cond:
+            self.flush_requests += 1
+            ticket = self.flush_requests
+        self.queue.put(self._FLUSH)
+        with self.cond:
+            done = self.cond.wait_for(lambda: self.flushes_done >= ticket, timeout)
+            return done and not self.failed
+
+    def close(self, timeout=None):
+        """Flushes pending records and stops the worker thread."""
+        saved = self.flush(timeout)
+        self.queue.put(self._STOP)
+        self.thread.join(timeout)
+        return saved
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is self._STOP: break
+            batch, flushes = [], 0
+            deadline = time.monotonic() + self.batch_window
+            # 在批处理窗口内继续收集记录, 遇到 flush/stop 请求立即写入
+            while True:
+                if item is self._FLUSH: flushes += 1; break
+                batch.append(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP: stopping = True; break
+            self.write_batch(batch, flushes)
+
+    def write_batch(self, batch, flushes=0):
+        with self.cond:
+            batch = self.failed + batch; self.failed = []
+        if not batch:
+            with self.cond:
+                self.flushes_done += flushes; self.cond.notify_all()
+            return
+        try:
+            self.data_manager.append_many([record for _, record in batch])
+            error = None
+        except Exception as e:
+            error = e
+        with self.cond:
+            if error is not None: self.failed = batch
+            self.processed_seq = max(self.processed_seq, batch[-1][0])
+            self.flushes_done += flushes
+            self.cond.notify_all()
+        seqs = [seq for seq, _ in batch]
+        if error is None:
+            if self.on_written: self.on_written(seqs)
+        elif self.on_error:
+            self.on_error(error, seqs)
+
+# ==================== Sync ====================
+# 设置后把每条记录的新增/修改/删除上传到汇总服务器 (参考实现见 tools/sync_receiver.py)
+SYNC_URL = os.environ.get('CDGJ_SYNC_URL')
+
+class SyncOutbox:
+    """
+    Durable log of record changes waiting to be uploaded, one JSON line per
+    change with an increasing seq. Register it as a DataManager listener.
+    cursor.json holds the last seq the receiver acknowledged, so a reconnect
+    resumes right after it instead of sending the day again.
+    """
+    COMPACT_AFTER = 1000  # 日志中已确认的行超过这个数时重写文件
+
+    def __init__(self, sync_dir):
+        os.makedirs(sync_dir, exist_ok=True)
+        self.path = os.path.join(sync_dir, 'outbox.jsonl')
+        self.cursor_path = os.path.join(sync_dir, 'cursor.json')
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.device_id = self.load_device_id(os.path.join(sync_dir, 'device_id'))
+        try:
+            with open(self.cursor_path, encoding='utf-8') as f:
+                self.acked = int(json.load(f)['acked'])
+        except (OSError, ValueError, KeyError, TypeError):
+            self.acked = 0
+        entries = []
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try: entries.append(json.loads(line))
+                    except ValueError: continue  # 写到一半被中断的最后一行
+        self.acked_lines = sum(entry['seq'] <= self.acked for entry in entries)
+        self.entries = [entry for entry in entries if entry['seq'] > self.acked]
+        self.next_seq = max([self.acked] + [entry['seq'] for entry in entries]) + 1
+
+    @staticmethod
+    def load_device_id(path):
+        """A random id for this installation, created on first use."""
+        try:
+            with open(path, encoding='utf-8') as f:
+                device_id = f.read().strip()
+            if device_id: return device_id
+        except OSError:
+            pass
+        device_id = os.urandom(8).hex()
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(device_id)
+        return device_id
+
+    def record_uid(self, day, record):
+        """
+        Id of a record on the receiver, from the device and the record's RECORD_ID_COLUMN,
+        which is never edited, so it stays the same through edits and deletes and
+        re-sent changes are idempotent.
+        """
+        key = '|'.join((self.device_id, day, str(record.get(RECORD_ID_COLUMN, ''))))
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+    def __call__(self, op, day, record):
+        self.append(op, day, record)
+
+    def append(self, op, day, record):
+        entry = {'op': 'delete' if op == 'delete' else 'upsert', 'uid': self.record_uid(day, record), 'day': day}
+        if op != 'delete': entry['record'] = {col: str(record.get(col, '')) for col in DATA_COLUMN_ORDER}
+        with self.lock:
+            entry['seq'] = self.next_seq; self.next_seq += 1
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                f.flush(); os.fsync(f.fileno())
+            self.entries.append(entry)
+        self.changed.set()
+
+    def pending(self, limit=None):
+        """The oldest unacknowledged entries, at most `limit` of them."""
+        with self.lock:
+            return self.entries[:limit]
+
+    @staticmethod
+    def coalesce(entries):
+        """Keeps only the last change of each record; every upsert carries the whole record."""
+        latest = {}
+        for entry in entries:
+            latest.pop(entry['uid'], None); latest[entry['uid']] = entry
+        return [{key: value for key, value in entry.items() if key != 'seq'} for entry in latest.values()]
+
+    def ack(self, seq):
+        """Marks everything up to seq as received and moves the cursor past it."""
+        with self.lock:
+            done = sum(entry['seq'] <= seq for entry in self.entries)
+            self.entries = self.entries[done:]
+            self.acked = max(self.acked, seq); self.acked_lines += done
+            tmp_path = self.cursor_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'acked': self.acked}, f)
+            os.replace(tmp_path, self.cursor_path)
+            if self.acked_lines >= self.COMPACT_AFTER:
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in self.entries)
+                os.replace(tmp_path, self.path)
+                self.acked_lines = 0
+
+class SyncClient:
+    """
+    Uploads the outbox to url in batches on a background thread. A batch is sent
+    until the receiver acknowledges its last seq; failures are retried with
+    exponential backoff and jitter. on_status(message) reports errors and
+    recoveries from the worker thread.
+    """
+    def __init__(self, outbox, url, batch_size=200, interval=30, min_backoff=2, max_backoff=300, timeout=15, on_status=None):
+        self.outbox = outbox
+        self.url = url
+        self.batch_size = batch_size
+        self.interval = interval
+        self.min_backoff = min_backoff; self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.on_status = on_status
+        self.failures = 0
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='sync', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self, timeout=None):
+        self.stopping.set(); self.outbox.changed.set()
+        self.thread.join(timeout)
+
+    def post(self, payload):
+        import urllib.request
+        request = urllib.request.Request(self.url, data=json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    @instrumented('sync.batch')
+    def sync_once(self):
+        """Sends one batch; returns the number of outbox entries it acknowledged."""
+        entries = self.outbox.pending(self.batch_size)
+        if not entries: return 0
+        first, last = entries[0]['seq'], entries[-1]['seq']
+        reply = self.post({'device': self.outbox.device_id, 'first_seq': first, 'last_seq': last,
+                           'changes': self.outbox.coalesce(entries)})
+        if not reply.get('ok') or reply.get('acked') != last:
+            raise ValueError(f"接收端未确认: {reply.get('error', reply)}")
+        self.outbox.ack(last)
+        metrics.count('sync.sent', len(entries))
+        return len(entries)
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.outbox.changed.clear()
+            try:
+                sent = self.sync_once()
+            except (OSError, ValueError) as e:
+                self.failures += 1
+                metrics.count('sync.error')
+                delay = min(self.max_backoff, self.min_backoff * 2 ** (self.failures - 1)) * random.uniform(0.5, 1)
+                if self.on_status: self.on_status(f"同步失败 ({self.failures} 次), {delay:.0f} 秒后重试: {e}")
+                self.stopping.wait(delay)
+                continue
+            if self.failures and self.on_status: self.on_status("同步已恢复")
+            self.failures = 0
+            # 还有积压就马上发下一批, 否则等新的修改或定时重试
+            if sent < self.batch_size: self.outbox.changed.wait(self.interval)
+
+# ==================== Streaming Ledger Reader ====================
+def _xml_ns(tag):
+    return tag[:tag.index('}') + 1] if tag.startswith('{') else ''
+
+def _column_index(cell_ref):
+    """'AB12' -> 27 (0-based)."""
+    index = 0
+    for ch in cell_ref:
+        if 'A' <= ch <= 'Z': index = index * 26 + ord(ch) - 64
+        else: break
+    return index - 1
+
+def _read_shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist(): return []
+    strings = []
+    with zf.open('xl/sharedStrings.xml') as f:
+        root = None
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            if root is None:
+                root = elem; ns = _xml_ns(elem.tag); si_tag, r_tag, t_tag = ns + 'si', ns + 'r', ns + 't'
+            if event != 'end' or elem.tag != si_tag: continue
+            # 富文本由多个 <r><t> 组成; <rPh> 中的注音不属于单元格内容
+            parts = []
+            for child in elem:
+                if child.tag == t_tag: parts.append(child.text or '')
+                elif child.tag == r_tag:
+                    t = child.find(t_tag)
+                    if t is not None: parts.append(t.text or '')
+            strings.append(''.join(parts))
+            root.remove(elem)
+    return strings
+
+def _sheet_paths(zf):
+    """{sheet name: part path inside the zip}, in workbook order."""
+    workbook = ElementTree.fromstring(zf.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+    paths = {}
+    for sheet in workbook.iter(_xml_ns(workbook.tag) + 'sheet'):
+        rel_id = next(value for key, value in sheet.attrib.items() if key.endswith('}id'))
+        target = targets[rel_id]
+        paths[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return paths
+
+def list_sheets(path):
+    with zipfile.ZipFile(path) as zf:
+        return list(_sheet_paths(zf))
+
+def iter_projected_rows(path, header_row, wanted, sheet=None):
+    """
+    Streams one sheet of an xlsx (the first unless `sheet` names another)
+    straight from its XML. Yields the header row (1-based `header_row`) as a
+    list of names first, then one list per data row holding only the `wanted`
+    columns, in order (None for empty cells).
+    Cells outside `wanted` are never decoded and each row is dropped from the
+    tree once yielded, so memory does not grow with the sheet.
+    """
+    with zipfile.ZipFile(path) as zf:
+        sheets = _sheet_paths(zf)
+        if sheet is None: sheet_path = next(iter(sheets.values()))
+        elif sheet in sheets: sheet_path = sheets[sheet]
+        else: raise KeyError(f"{os.path.basename(path)} 中没有工作表: {sheet}")
+        shared = _read_shared_strings(zf)
+        with zf.open(sheet_path) as f:
+            ns = sheet_data = slots = None; row_number = 0
+            for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+                if ns is None:
+                    ns = _xml_ns(elem.tag); row_tag, cell_tag, value_tag, t_tag = ns + 'row', ns + 'c', ns + 'v', ns + 't'
+                if event == 'start':
+                    if elem.tag == ns + 'sheetData': sheet_data = elem
+                    continue
+                if elem.tag != row_tag: continue
+                row_number = int(elem.get('r') or row_number + 1)
+                if row_number >= header_row:
+                    if slots is None:
+                        header = {}
+                    else:
+                        values = [None] * len(wanted)
+                    col = -1
+                    for cell in elem.iter(cell_tag):
+                        ref = cell.get('r'); col = _column_index(ref) if ref else col + 1
+                        if slots is not None:
+                            slot = slots.get(col)
+                            if slot is None: continue
+                        cell_type = cell.get('t')
+                        if cell_type == 'inlineStr':
+                            value = ''.join(t.text or '' for t in cell.iter(t_tag))
+                        else:
+                            v = cell.find(value_tag)
+                            if v is None or v.text is None: continue
+                            text = v.text
+                            if cell_type == 's': value = shared[int(text)]
+                            elif cell_type in ('str', 'e'): value = text
+                            elif cell_type == 'b': value = text == '1'
+                            elif '.' in text or 'E' in text or 'e' in text: value = float(text)
+                            else: value = int(text)
+                        if slots is None: header[col] = value
+                        else: values[slot] = value
+                    if slots is None:
+                        names = [str(header[i]).strip() if header.get(i) is not None else '' for i in range(max(header, default=-1) + 1)]
+                        slots = {names.index(name): slot for slot, name in enumerate(wanted) if name in names}
+                        yield names
+                    else:
+                        yield values
+                # 处理完的行立即从树上摘除, 内存占用与表格大小无关
+                if sheet_data is not None: sheet_data.remove(elem)
+                else: elem.clear()
+
+# ==================== Ledger Store ====================
+def compact_column(values):
+    """
+    Packs one ledger column. All-integer columns become an int64 array plus the
+    positions of blank cells; anything else stays a list whose repeated strings
+    share one object. Returns (values, blank positions).
+    """
+    blanks = frozenset(pos for pos, value in enumerate(values) if value == '')
+    if len(blanks) < len(values) and all(type(value) is int for value in values if value != ''):
+        try:
+            return array('q', (0 if value == '' else value for value in values)), blanks
+        except OverflowError:
+            pass
+    pool = {}
+    return [pool.setdefault(value, value) if type(value) is str else value for value in values], frozenset()
+
+class LedgerStore:
+    """The ledger's REQUIRED_COLUMNS kept column by column; store[pos] is a LedgerRecord view of one row."""
+    def __init__(self, columns):
+        self.names = list(columns)
+        self.length = len(next(iter(columns.values()), []))
+        self.columns, self.blanks = {}, {}
+        for name, values in columns.items():
+            self.columns[name], self.blanks[name] = compact_column(values)
+        # 行来自哪个台账: sources[i] 从第 offsets[i] 行开始
+        self.sources = ['']; self.offsets = [0]
+
+    @classmethod
+    def concat(cls, stores, sources):
+        """Joins stores row-wise; sources[i] labels the rows that came from stores[i]."""
+        merged = cls({name: [value for store in stores for value in store.column_values(name)] for name in stores[0].names})
+        merged.sources = list(sources)
+        merged.offsets = list(itertools.accumulate([0] + [len(store) for store in stores[:-1]]))
+        return merged
+
+    def extended(self, stores, sources):
+        """A copy with stores appended as further parts; existing rows keep their positions and labels."""
+        merged = LedgerStore.concat([self] + list(stores), [''] + list(sources))
+        merged.sources = self.sources + list(sources)
+        merged.offsets = self.offsets + merged.offsets[1:]
+        return merged
+
+    def part_ranges(self, source):
+        """(start, end) of every part labelled source."""
+        ends = self.offsets[1:] + [self.length]
+        return [(start, end) for label, start, end in zip(self.sources, self.offsets, ends) if label == source]
+
+    def column_values(self, name):
+        """The column as a plain list, blanks as ''."""
+        column, blanks = self.columns[name], self.blanks[name]
+        if not blanks: return list(column)
+        return ['' if pos in blanks else value for pos, value in enumerate(column)]
+
+    def source_of(self, pos):
+        return self.sources[bisect.bisect_right(self.offsets, pos) - 1]
+
+    def value(self, name, pos):
+        if pos in self.blanks[name]: return ''
+        return self.columns[name][pos]
+
+    def column(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, pos):
+        if not 0 <= pos < self.length: raise IndexError(pos)
+        return LedgerRecord(self, pos)
+
+    def __iter__(self):
+        return (LedgerRecord(self, pos) for pos in range(self.length))
+
+class LedgerRecord(Mapping):
+    """Read-only view of one ledger row that stands in for the old record dict (.get, [], items ...)."""
+    __slots__ = ('store', 'pos')
+
+    def __init__(self, store, pos):
+        self.store = store; self.pos = pos
+
+    @property
+    def source(self):
+        """Label of the ledger file (and sheet) this row came from."""
+        return self.store.source_of(self.pos)
+
+    def __getitem__(self, name):
+        if name not in self.store.columns: raise KeyError(name)
+        return self.store.value(name, self.pos)
+
+    def __iter__(self):
+        return iter(self.store.names)
+
+    def __len__(self):
+        return len(self.store.names)
+
+    def __repr__(self):
+        return f'LedgerRecord({dict(self)!r})'
+
+# ==================== Ledger Cache ====================
+class LedgerCache:
+    """
+    Stores each cleaned ledger source on disk, keyed by the file's size, mtime
+    and content hash. A source is a path or a (path, sheet name) pair.
+    """
+    VERSION = 4
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def snapshot_path(self, source):
+        path, sheet = split_source(source)
+        name = os.path.abspath(path) + ('#' + sheet if sheet else '')
+        key = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f'ledger_{key}.pkl')
+
+    @staticmethod
+    def file_digest(path):
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fingerprint(self, excel_path):
+        st = os.stat(excel_path)
+        return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'sha1': self.file_digest(excel_path)}
+
+    def load(self, source):
+        """Returns the snapshot if it still matches the ledger file, otherwise None."""
+        excel_path, _ = split_source(source)
+        path = self.snapshot_path(source)
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except Exception:
+            return None  # 缓存损坏时直接重新解析
+        if not isinstance(snapshot, dict) or snapshot.get('version') != self.VERSION: return None
+        st = os.stat(excel_path); fp = snapshot['fingerprint']
+        if fp['size'] != st.st_size: return None
+        if fp['mtime_ns'] != st.st_mtime_ns:
+            # 安卓端每次选择文件都会重新复制一份, mtime 变了但内容可能没变
+            if fp['sha1'] != self.file_digest(excel_path): return None
+            fp['mtime_ns'] = st.st_mtime_ns
+            try: self.write(path, snapshot)
+            except OSError: pass
+        return snapshot
+
+    def save(self, source, fingerprint, store, suffix_index):
+        snapshot = {'version': self.VERSION, 'fingerprint': fingerprint, 'store': store, 'suffix_index': suffix_index}
+        self.write(self.snapshot_path(source), snapshot)
+
+    def write(self, path, snapshot):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+# ==================== Database Class ====================
+class LoadCancelled(Exception):
+    """Raised inside AssetDatabase loading when its cancel_event is set."""
+
+def split_source(source):
+    """'path' or (path, sheet) -> (path, sheet or None)."""
+    if isinstance(source, str): return source, None
+    path, sheet = source
+    return path, sheet or None
+
+def source_label(source):
+    path, sheet = split_source(source)
+    return os.path.basename(path) + (f'#{sheet}' if sheet else '')
+
+def parse_ledger_sources(text, all_sheets=False):
+    """
+    Splits the StartupScreen path field into [(path, sheet)] sources. Entries are
+    separated by ';' or new lines; 'path#工作表' reads one sheet and 'path#*' every
+    sheet, which is also what all_sheets does for entries without a sheet.
+    """
+    sources = []
+    for part in re.split(r'[;\n]', text):
+        path, sheet = part.strip(), None
+        if not path: continue
+        if '#' in path and not os.path.exists(path):
+            path, sheet = (s.strip() for s in path.rsplit('#', 1))
+        if sheet == '*' or (all_sheets and not sheet):
+            sources.extend((path, name) for name in list_sheets(path))
+        else:
+            sources.append((path, sheet or None))
+    return list(dict.fromkeys(sources))
+
+def parse_suffix_list(text):
+    """
+    Splits a pasted or scanned list into asset suffixes, in order and without repeats.
+    Any run of whitespace, commas or semicolons separates entries; non-digits are dropped.
+    """
+    suffixes = (re.sub(r'\D', '', part) for part in re.split(r'[\s,;，；、]+', text))
+    return list(dict.fromkeys(suffix for suffix in suffixes if suffix))
+
+class BatchLookup:
+    """
+    Result of AssetDatabase.lookup_many. Suffixes are split into unique hits,
+    multiple matches and misses; hits and multiple matches are staged, in the
+    order they were given, so the form for each meter can open without another lookup.
+    """
+    def __init__(self, suffixes, matches):
+        self.suffixes = suffixes
+        self.matches = matches
+        self.hits = [s for s in suffixes if len(matches[s]) == 1]
+        self.multiple = [s for s in suffixes if len(matches[s]) > 1]
+        self.misses = [s for s in suffixes if not matches[s]]
+        self.staged = [s for s in suffixes if matches[s]]
+        self.skipped = []  # 多条匹配时没有选出记录就关闭了选择框的
+        self.position = 0
+
+    def summary(self):
+        text = f"共 {len(self.suffixes)} 个: 唯一命中 {len(self.hits)}, 多条匹配 {len(self.multiple)}, 未找到 {len(self.misses)}"
+        if self.skipped: text += f"\n未选择记录而跳过 {len(self.skipped)} 个: {', '.join(self.skipped)}"
+        return text
+
+    def skip(self, suffix):
+        """Notes a staged meter that was passed over without choosing a record, for summary()."""
+        self.skipped.append(suffix)
+
+    @property
+    def remaining(self):
+        return len(self.staged) - self.position
+
+    def next(self):
+        """(suffix, [records]) for the next staged meter, or None when the batch is done."""
+        if self.position >= len(self.staged): return None
+        suffix = self.staged[self.position]
+        self.position += 1
+        return suffix, self.matches[suffix]
+
+def _process_pool(workers):
+    """A process pool for parsing ledgers, or None where there is none (Android, Windows)."""
+    # spawn 会在子进程里重新导入 main.py 并创建 Kivy 窗口, 所以只用 fork
+    if IS_ANDROID or 'fork' not in multiprocessing.get_all_start_methods(): return None
+    try:
+        return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'),
+                                                      initializer=_init_pool_worker)
+    except (OSError, ImportError, NotImplementedError):
+        return None
+
+def _init_pool_worker():
+    """
+    Runs first in each forked worker. fork copies only the loading thread, so a
+    lock another thread held at that moment stays locked forever in the child:
+    the worker gets its own metrics lock and records nothing.
+    """
+    metrics.enabled = False
+    metrics.lock = threading.Lock()
+
+class AssetDatabase:
+    # 默认按资产号后6位建立索引, 其它长度的后缀查询退回到逐行扫描
+    DEFAULT_SUFFIX_LENGTHS = (6,)
+    SEARCH_LENGTH = 6  # 边输入边查询时按后6位的前缀匹配
+    PROGRESS_EVERY = 10000  # 每解析多少行回调一次进度并检查是否取消
+
+    @instrumented('ledger.load')
+    def __init__(self, sources, suffix_lengths=DEFAULT_SUFFIX_LENGTHS, cache_dir=None, progress=None, cancel_event=None, workers=None):
+        """
+        sources is a ledger path, or a list of paths and (path, sheet) pairs.
+        Several sources are parsed in parallel and merged into one index; each
+        record keeps its source label (record.source), and 原表资产号 found in
+        more than one source are collected once in self.duplicates.
+        progress(rows_parsed) is called periodically from the loading thread;
+        setting cancel_event aborts the load with LoadCancelled.
+        """
+        if isinstance(sources, (str, tuple)): sources = [sources]
+        self.sources = list(dict.fromkeys(split_source(source) for source in sources))
+        self.excel_path = self.sources[0][0]
+        self.suffix_lengths = tuple(suffix_lengths)
+        self.cache_dir = cache_dir; self.workers = workers
+        # 加载前记下各文件的大小和修改时间, reload() 据此判断哪些台账更新过
+        self.file_stats = {source: self.file_stat(source) for source in self.sources}
+        cache = LedgerCache(cache_dir) if cache_dir else None
+        snapshots = [cache.load(source) if cache else None for source in self.sources]
+        self.from_cache = all(snapshots)
+        for snapshot in snapshots:
+            metrics.count('ledger.cache_hit' if snapshot else 'ledger.cache_miss')
+        missing = [source for source, snapshot in zip(self.sources, snapshots) if snapshot is None]
+        fingerprints = {source: cache.fingerprint(source[0]) for source in missing} if cache else {}
+        parsed = self.parse_sources(missing, progress, cancel_event, workers)
+        if cancel_event is not None and cancel_event.is_set(): raise LoadCancelled()
+
+        parts = []
+        for source, snapshot in zip(self.sources, snapshots):
+            store, suffix_index = (snapshot['store'], snapshot['suffix_index']) if snapshot else (parsed[source], None)
+            if suffix_index is None or set(suffix_index) != set(self.suffix_lengths):
+                suffix_index = self.build_suffix_index(store.column('原表资产号'), self.suffix_lengths)
+                if cache:
+                    try: cache.save(source, snapshot['fingerprint'] if snapshot else fingerprints[source], store, suffix_index)
+                    except OSError: pass
+            parts.append((store, suffix_index))
+        labels = [source_label(source) for source in self.sources]
+        if len(parts) == 1:
+            store, suffix_index = parts[0]
+            store.sources = labels
+        else:
+            store = LedgerStore.concat([part[0] for part in parts], labels)
+            suffix_index = self.build_suffix_index(store.column('原表资产号'), self.suffix_lengths)
+        # records[pos] 是只读的行视图, 不再为每行创建 dict
+        self.records = store
+        self.asset_numbers = store.column('原表资产号')
+        self.suffix_index = suffix_index
+        self.duplicates = self.find_cross_source_duplicates() if len(parts) > 1 else {}
+        self._search_keys = None
+        self._short_numbers = None
+
+    @classmethod
+    def parse_sources(cls, sources, progress=None, cancel_event=None, workers=None):
+        """Parses each (path, sheet) source into a LedgerStore, in a process pool when there are several."""
+        workers = min(len(sources), workers or os.cpu_count() or 1)
+        pool = _process_pool(workers) if workers > 1 else None
+        stores, rows_done = {}, 0
+        if pool is None:
+            for source in sources:
+                report = (lambda rows, base=rows_done: progress(base + rows)) if progress else None
+                stores[source] = LedgerStore(cls.read_ledger(source[0], progress=report, cancel_event=cancel_event, sheet=source[1]))
+                rows_done += len(stores[source])
+            return stores
+        futures = {}
+        try:
+            futures = {pool.submit(_parse_ledger_source, source): source for source in sources}
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+                if cancel_event is not None and cancel_event.is_set(): raise LoadCancelled()
+                for future in done:
+                    stores[futures[future]] = store = future.result()
+                    rows_done += len(store)
+                    if progress: progress(rows_done)
+        finally:
+            # shutdown(cancel_futures=True) 需要 Python 3.9, 这里自己取消还没开始的任务
+            for future in futures: future.cancel()
+            pool.shutdown(wait=False)
+        return stores
+
+    def find_cross_source_duplicates(self):
+        """{原表资产号: [source labels]} for numbers that occur in more than one source."""
+        store = self.records
+        first_seen, duplicates = {}, {}
+        for part, (start, end) in enumerate(zip(store.offsets, store.offsets[1:] + [len(store)])):
+            source = store.sources[part]  # reload() 之后同一台账可能分成几段
+            for asset in self.asset_numbers[start:end]:
+                if not asset: continue
+                seen = first_seen.setdefault(asset, source)
+                if seen != source: duplicates.setdefault(asset, {seen}).add(source)
+        return {asset: sorted(sources, key=store.sources.index) for asset, sources in duplicates.items()}
+
+    @staticmethod
+    def file_stat(source):
+        st = os.stat(source[0])
+        return st.st_size, st.st_mtime_ns
+
+    @instrumented('ledger.reload')
+    def reload(self, progress=None, cancel_event=None):
+        """
+        Re-reads only the sources whose file changed since loading and returns
+        (new database, {'added': n, 'removed': n, 'changed': n}), or (self, zeros)
+        when no file changed. Rows are matched by 原表资产号: unchanged rows keep
+        their positions, new and changed rows are appended, and removed or
+        replaced rows are blanked, so only those positions touch the suffix
+        index. This object is left as it is and keeps answering lookups, and
+        records taken from it stay valid, until the caller swaps in the new one.
+        """
+        stats = {source: self.file_stat(source) for source in self.sources}
+        changed = [source for source in self.sources if stats[source] != self.file_stats[source]]
+        counts = dict.fromkeys(('added', 'removed', 'changed'), 0)
+        if not changed: return self, counts
+        cache = LedgerCache(self.cache_dir) if self.cache_dir else None
+        fingerprints = {source: cache.fingerprint(source[0]) for source in changed} if cache else {}
+        parsed = self.parse_sources(changed, progress, cancel_event, self.workers)
+        if cancel_event is not None and cancel_event.is_set(): raise LoadCancelled()
+
+        dropped, stores, labels = [], [], []
+        for source in changed:
+            store = parsed[source]
+            dead, fresh = self.diff_source(source_label(source), store, counts)
+            dropped.extend(dead)
+            if fresh:
+                stores.append(LedgerStore({name: [store.value(name, pos) for pos in fresh] for name in store.names}))
+                labels.append(source_label(source))
+            if cache:
+                try: cache.save(source, fingerprints[source], store, self.build_suffix_index(store.column('原表资产号'), self.suffix_lengths))
+                except OSError: pass
+        records = self.records.extended(stores, labels)
+        asset_numbers = records.column('原表资产号')
+        removed = [(pos, asset_numbers[pos]) for pos in dropped]
+        for pos in dropped: asset_numbers[pos] = ''  # 作废的行留在原位, 查询和扫描都会跳过
+        added = [(pos, asset_numbers[pos]) for pos in range(len(self.records), len(records))]
+
+        db = copy.copy(self)
+        db.records, db.asset_numbers, db.file_stats = records, asset_numbers, stats
+        db.suffix_index = self.patched_suffix_index(removed, added)
+        db.duplicates = db.find_cross_source_duplicates() if len(self.sources) > 1 else {}
+        db._search_keys = None; db._short_numbers = None
+        return db, counts
+
+    def diff_source(self, label, store, counts):
+        """
+        Matches the live rows of one source against its re-read store by 原表资产号,
+        pairing repeated numbers in file order. Returns (old positions to drop,
+        store positions to add) and adds to counts.
+        """
+        records, names = self.records, self.records.names
+        old_rows = {}
+        for start, end in records.part_ranges(label):
+            for pos in range(start, end):
+                asset = self.asset_numbers[pos]
+                if asset: old_rows.setdefault(asset, []).append(pos)
+        new_rows = {}
+        for pos, asset in enumerate(store.column('原表资产号')):
+            new_rows.setdefault(asset, []).append(pos)
+        dead, fresh = [], []
+        for asset, new_positions in new_rows.items():
+            old_positions = old_rows.pop(asset, [])
+            for old_pos, new_pos in zip(old_positions, new_positions):
+                if any(records.value(name, old_pos) != store.value(name, new_pos) for name in names):
+                    dead.append(old_pos); fresh.append(new_pos); counts['changed'] += 1
+            dead.extend(old_positions[len(new_positions):]); counts['removed'] += max(0, len(old_positions) - len(new_positions))
+            fresh.extend(new_positions[len(old_positions):]); counts['added'] += max(0, len(new_positions) - len(old_positions))
+        for old_positions in old_rows.values():
+            dead.extend(old_positions); counts['removed'] += len(old_positions)
+        return dead, sorted(fresh)
+
+    def patched_suffix_index(self, removed, added):
+        """
+        A copy of the suffix index without the (position, asset) pairs in removed
+        and with those in added. Position lists are copied before they change, so
+        the current index keeps serving lookups unchanged.
+        """
+        index = {}
+        for length, buckets in self.suffix_index.items():
+            buckets, owned = dict(buckets), set()
+            for pos, asset in removed:
+                if len(asset) < length: continue
+                key = asset[-length:]; hit = buckets[key]
+                if type(hit) is int: del buckets[key]; continue
+                hit = [p for p in hit if p != pos]; owned.add(key)
+                buckets[key] = hit[0] if len(hit) == 1 else hit
+            for pos, asset in added:
+                if len(asset) < length: continue
+                key = asset[-length:]; hit = buckets.get(key)
+                if hit is None: buckets[key] = pos
+                elif type(hit) is int: buckets[key] = [hit, pos]; owned.add(key)
+                elif key in owned: hit.append(pos)
+                else: buckets[key] = hit + [pos]; owned.add(key)
+            index[length] = buckets
+        return index
+
+    @staticmethod
+    @instrumented('ledger.parse')
+    def read_ledger(excel_path, header_row=LEDGER_HEADER_ROW, progress=None, cancel_event=None, sheet=None):
+        """
+        Streams one sheet (the first by default) and keeps only REQUIRED_COLUMNS.
+        Returns the cleaned columns as {column: list}.
+        """
+        rows = iter_projected_rows(excel_path, header_row, REQUIRED_COLUMNS, sheet)
+        header = next(rows, [])
+        missing_cols = [col for col in REQUIRED_COLUMNS if col not in header]
+        if missing_cols: rows.close(); raise KeyError(f"Excel文件缺少必要的列: {', '.join(missing_cols)}")
+        columns = [[] for _ in REQUIRED_COLUMNS]
+        asset_slot = REQUIRED_COLUMNS.index('原表资产号')
+        for row_count, values in enumerate(rows, 1):
+            if row_count % AssetDatabase.PROGRESS_EVERY == 0:
+                if cancel_event is not None and cancel_event.is_set(): rows.close(); raise LoadCancelled()
+                if progress: progress(row_count)
+            asset = values[asset_slot]
+            if asset is None: continue
+            asset = str(asset).strip()
+            if not asset: continue
+            values[asset_slot] = asset
+            for column, value in zip(columns, values):
+                column.append('' if value is None else value)
+        return dict(zip(REQUIRED_COLUMNS, columns))
+
+    @staticmethod
+    @instrumented('ledger.build_index')
+    def build_suffix_index(asset_numbers, suffix_lengths):
+        """Maps each suffix length to {suffix: row position, or a list of them when the suffix repeats}."""
+        index = {}
+        for length in suffix_lengths:
+            buckets = {}
+            for pos, asset in enumerate(asset_numbers):
+                if len(asset) < length: continue
+                key = asset[-length:]
+                hit = buckets.get(key)
+                if hit is None: buckets[key] = pos
+                elif type(hit) is int: buckets[key] = [hit, pos]
+                else: hit.append(pos)
+            index[length] = buckets
+        return index
+
+    @instrumented('ledger.lookup')
+    def get_info_by_last_6_digits(self, last_6_digits):
+        last_6_digits = str(last_6_digits).strip()
+        if not last_6_digits: return []
+        buckets = self.suffix_index.get(len(last_6_digits))
+        if buckets is not None:
+            hit = buckets.get(last_6_digits)
+            if hit is None: return []
+            if type(hit) is int: return [self.records[hit]]
+            return [self.records[pos] for pos in hit]
+        metrics.count('ledger.lookup_scan')
+        return [self.records[pos] for pos, asset in enumerate(self.asset_numbers) if asset.endswith(last_6_digits)]
+
+    def positions(self, asset):
+        """
+        Row positions whose 原表资产号 is exactly asset, found through the longest
+        fitting suffix index, or short_numbers() for numbers shorter than all of them.
+        """
+        length = max((length for length in self.suffix_lengths if length <= len(asset)), default=None)
+        if length is None: return list(self.short_numbers().get(asset, ()))
+        hit = self.suffix_index[length].get(asset[-length:])
+        hits = [] if hit is None else [hit] if type(hit) is int else hit
+        return [pos for pos in hits if self.asset_numbers[pos] == asset]
+
+    def short_numbers(self):
+        """{原表资产号: [positions]} of the numbers no suffix index covers, built on first use."""
+        if self._short_numbers is None:
+            shortest = min(self.suffix_lengths, default=None)
+            index = {}
+            for pos, number in enumerate(self.asset_numbers):
+                if number and (shortest is None or len(number) < shortest): index.setdefault(number, []).append(pos)
+            self._short_numbers = index
+        return self._short_numbers
+
+    def search_keys(self):
+        """The indexed 6-digit suffixes in sorted order, built on first use (call it from the loading thread)."""
+        if self._search_keys is None:
+            buckets = self.suffix_index.get(self.SEARCH_LENGTH)
+            if buckets is None: buckets = self.build_suffix_index(self.asset_numbers, (self.SEARCH_LENGTH,))[self.SEARCH_LENGTH]
+            self._search_buckets = buckets
+            self._search_keys = sorted(buckets)
+        return self._search_keys
+
+    @instrumented('ledger.search')
+    def search(self, typed, limit=8):
+        """
+        Live search for a partly typed suffix. Returns (records, matching suffix count):
+        up to `limit` records whose last 6 digits start with `typed`, in suffix order.
+        Input longer than 6 digits is matched against the end of the asset number.
+        """
+        typed = str(typed).strip()
+        if not typed: return [], 0
+        length = self.SEARCH_LENGTH
+        if len(typed) >= length:
+            records = [record for record in self.get_info_by_last_6_digits(typed[-length:]) if record['原表资产号'].endswith(typed)]
+            return records[:limit], len(records)
+        keys = self.search_keys()
+        # 后缀都是数字, ':' 排在 '9' 之后, 所以 [typed, typed + ':') 就是所有以 typed 开头的后缀
+        lo, hi = bisect.bisect_left(keys, typed), bisect.bisect_left(keys, typed + ':')
+        buckets = self._search_buckets
+        records = []
+        for key in itertools.islice(keys, lo, hi):
+            hit = buckets[key]
+            for pos in ([hit] if type(hit) is int else hit):
+                records.append(self.records[pos])
+                if len(records) >= limit: return records, hi - lo
+        return records, hi - lo
+
+    @instrumented('ledger.lookup_many')
+    def lookup_many(self, suffixes):
+        """
+        Resolves a list of suffixes in one pass and returns a BatchLookup.
+        Indexed lengths are answered from the suffix index; all other lengths share
+        a single scan over the asset numbers instead of one scan per suffix.
+        """
+        suffixes = list(dict.fromkeys(str(s).strip() for s in suffixes if str(s).strip()))
+        positions, unindexed = {}, {}
+        for suffix in suffixes:
+            buckets = self.suffix_index.get(len(suffix))
+            if buckets is None:
+                unindexed.setdefault(len(suffix), set()).add(suffix)
+                positions[suffix] = []
+                continue
+            hit = buckets.get(suffix)
+            positions[suffix] = [] if hit is None else [hit] if type(hit) is int else list(hit)
+        if unindexed:
+            metrics.count('ledger.lookup_scan')
+            for pos, asset in enumerate(self.asset_numbers):
+                for length, wanted in unindexed.items():
+                    if asset[-length:] in wanted and len(asset) >= length: positions[asset[-length:]].append(pos)
+        records = self.records
+        return BatchLookup(suffixes, {suffix: [records[pos] for pos in hits] for suffix, hits in positions.items()})
+
+def _parse_ledger_source(source):
+    """Process-pool worker for AssetDatabase.parse_sources."""
+    return LedgerStore(AssetDatabase.read_ledger(source[0], sheet=source[1]))
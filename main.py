@@ -1,13 +1,23 @@
+import time
+APP_STARTED = time.perf_counter()  # 用于测量启动到首帧的时间
+
 import os
-import pandas as pd
 from datetime import datetime
 import traceback
+import threading
+import itertools
 from functools import partial
 
+from core import (
+    DATA_COLUMN_ORDER, SYNC_URL, AssetDatabase, DailyArchive, DailyStats, SyncClient, SyncOutbox, LoadCancelled, RecordValidator,
+    WriteBehindQueue, create_data_manager, instrumented, metrics,
+    parse_ledger_sources, parse_suffix_list, source_label,
+)
+
 # ==================== Kivy & Font Setup ====================
 from kivy.core.text import LabelBase
 from kivy.resources import resource_add_path
-from kivy.utils import platform, get_color_from_hex
+from kivy.utils import platform, get_color_from_hex, escape_markup
 from kivy.factory import Factory
 
 # 动态添加字体路径
@@ -26,7 +36,12 @@ from kivy.uix.button import Button
 from kivy.uix.textinput import TextInput
 from kivy.uix.screenmanager import ScreenManager, Screen, NoTransition
 from kivy.uix.spinner import Spinner
+from kivy.uix.checkbox import CheckBox
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.metrics import dp
 from kivy.clock import Clock
 from kivy.properties import StringProperty, ObjectProperty
 from kivy.core.window import Window
@@ -55,9 +70,8 @@ if platform == 'android':
     PythonActivity = autoclass('org.kivy.android.PythonActivity')
 
 # ==================== Global Constants & Theming ====================
-REQUIRED_COLUMNS = ['客户号', '用户名', '原表资产号', '原表表码']
+# 台账列、数据列顺序等常量见 core.py
 INSTALLER_NAMES = '胡军明、胡柏兴、胡海亮、梁群平'
-DATA_COLUMN_ORDER = ['客户号', '用户名', '原表资产号', '原表表码', '新资产号', '表计类型', '铅封号', '表箱类型', '材料使用', '安装人员', '备注', '录入时间']
 
 
 C = {
@@ -114,94 +128,13 @@ def show_popup_global(title, message):
     )
     btn.bind(on_press=popup.dismiss); popup.open()
 
-# ==================== DataManager (Updated with Code-Level Fix) ====================
-class DataManager:
-    """Handles all logic related to reading from and writing to the daily Excel file."""
-    def get_output_path(self):
-        """Generates the file path for today's data file."""
-        if platform == 'android':
-            output_dir = Environment.getExternalStoragePublicDirectory(Environment.DIRECTORY_DOWNLOADS).getAbsolutePath()
-        else:
-            output_dir = os.path.expanduser('~/Downloads')
-        
-        if not os.path.exists(output_dir):
-            try:
-                os.makedirs(output_dir)
-            except OSError as e:
-                if not os.path.isdir(output_dir):
-                    raise
-                    
-        today_str = datetime.now().strftime("%Y%m%d")
-        return os.path.join(output_dir, f'录入结果_{today_str}.xlsx')
-
-    def load_daily_data(self):
-        """
-        Loads data from today's file. It first reads the Excel file and then
-        converts all columns to strings to avoid potential dtype issues on Android.
-        """
-        output_file = self.get_output_path()
-        if os.path.exists(output_file):
-            try:
-                # Step 1: Read the Excel file without the problematic 'dtype' parameter.
-                df = pd.read_excel(output_file, engine='openpyxl')
-
-                # Step 2: After loading, first fill any NaN (empty) cells with an 
-                # empty string, and then convert the entire DataFrame to string type.
-                # This is a much more stable, two-step process.
-                df = df.fillna('').astype(str)
-                
-                return df
-
-            except Exception as e:
-                # If reading fails, show an error and return a safe, empty DataFrame.
-                show_popup_global("加载错误", f"读取当日数据文件时出错:\n{e}")
-                return pd.DataFrame(columns=DATA_COLUMN_ORDER)
-
-        # If the file doesn't exist, return a new empty DataFrame as before.
-        return pd.DataFrame(columns=DATA_COLUMN_ORDER)
-
-    def save_daily_data(self, df):
-        """Saves the given DataFrame to today's file."""
-        output_file = self.get_output_path()
-        df_to_save = pd.DataFrame(columns=DATA_COLUMN_ORDER)
-        df_to_save = pd.concat([df_to_save, df], ignore_index=True)
-        df_to_save = df_to_save.reindex(columns=DATA_COLUMN_ORDER)
-        
-        df_to_save.to_excel(output_file, index=False, engine='openpyxl')
-        
-    def append_data(self, data_dict):
-        """Appends a new row of data to today's file."""
-        for key, value in data_dict.items():
-            data_dict[key] = str(value)
-            
-        df = self.load_daily_data()
-        new_row = pd.DataFrame([data_dict])
-        df = pd.concat([df, new_row], ignore_index=True)
-        self.save_daily_data(df)
-
-# ==================== Database Class (Unchanged) ====================
-class AssetDatabase:
-    def __init__(self, excel_path):
-        try:
-            self.df = pd.read_excel(excel_path, header=2, engine='openpyxl')
-        except FileNotFoundError:
-            self.df = pd.DataFrame(); raise
-        missing_cols = [col for col in REQUIRED_COLUMNS if col not in self.df.columns]
-        if missing_cols: raise KeyError(f"Excel文件缺少必要的列: {', '.join(missing_cols)}")
-        self.df.dropna(subset=['原表资产号'], inplace=True)
-        self.df['原表资产号'] = self.df['原表资产号'].astype(str).str.strip()
-    def get_info_by_last_6_digits(self, last_6_digits):
-        last_6_digits = str(last_6_digits).strip()
-        if not last_6_digits: return []
-        matches = self.df[self.df['原表资产号'].str.endswith(last_6_digits)].copy()
-        return matches.to_dict('records')
-
 # ==================== UI Screens ====================
 class StartupScreen(Screen):
     ACTIVITY_RESULT_FILE_PICKER = 101
     log_text = StringProperty("文件操作日志:\n")
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.load_thread = None; self.cancel_event = None
         self.build_ui()
         if platform == 'android': self.android_init()
     def build_ui(self):
@@ -210,7 +143,7 @@ class StartupScreen(Screen):
         header.add_widget(ThemedLabel(text="轮换表计录入系统", font_size='24sp', bold=True, halign='center'))
         root.add_widget(header)
         main_card = Card()
-        main_card.add_widget(ThemedLabel(text="请选择包含客户数据的Excel台账文件 (.xlsx)", size_hint_y=None, height='30dp'))
+        main_card.add_widget(ThemedLabel(text="请选择包含客户数据的Excel台账文件 (.xlsx, 可多选)", size_hint_y=None, height='30dp'))
         path_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
         self.excel_path_input = ThemedTextInput(
             hint_text="点击“浏览”选择文件...", text=os.path.join(os.getcwd(), 'assets', '轮换表计台账.xlsx'),
@@ -219,8 +152,13 @@ class StartupScreen(Screen):
         path_layout.add_widget(self.excel_path_input)
         browse_btn = ThemedButton(text="浏览", size_hint_x=0.25); browse_btn.bind(on_press=self.browse_file)
         path_layout.add_widget(browse_btn); main_card.add_widget(path_layout)
-        start_btn = ThemedButton(text="启动系统", size_hint_y=None, height='44dp'); start_btn.bind(on_press=self.start_app)
-        main_card.add_widget(start_btn); root.add_widget(main_card)
+        sheets_layout = BoxLayout(size_hint_y=None, height='30dp')
+        self.all_sheets_checkbox = CheckBox(size_hint_x=None, width='30dp', color=C["primary"])
+        sheets_layout.add_widget(self.all_sheets_checkbox)
+        sheets_layout.add_widget(ThemedLabel(text="读取每个文件中的全部工作表", halign='left', font_size='14sp'))
+        main_card.add_widget(sheets_layout)
+        self.start_btn = ThemedButton(text="启动系统", size_hint_y=None, height='44dp'); self.start_btn.bind(on_press=self.start_app)
+        main_card.add_widget(self.start_btn); root.add_widget(main_card)
         log_card = Card(padding=('10dp', '10dp'))
         log_card.add_widget(ThemedLabel(text="操作日志", size_hint_y=None, height='30dp', color=C["text_secondary"]))
         log_scroll = ScrollView()
@@ -230,6 +168,8 @@ class StartupScreen(Screen):
         log_scroll.add_widget(self.log_textinput); log_card.add_widget(log_scroll); root.add_widget(log_card)
         footer = ThemedLabel(text="延寿供电所 - K-2025年制", font_size='12sp', size_hint_y=None, height='30dp', color=C["text_secondary"])
         root.add_widget(footer); self.add_widget(root); self.add_log("系统初始化完成。")
+    def on_enter(self, *args):
+        self.log_metrics()
     def add_log(self, message):
         timestamp = datetime.now().strftime("%H:%M:%S"); log_entry = f"[{timestamp}] {message}\n"
         self.log_text += log_entry; self.log_textinput.text = self.log_text
@@ -251,14 +191,15 @@ class StartupScreen(Screen):
         else:
             try:
                 from plyer import filechooser
-                filechooser.open_file(on_selection=self.handle_selection, title="请选择台账Excel文件", filters=[("Excel Files", "*.xlsx", "*.xls")])
+                filechooser.open_file(on_selection=self.handle_selection, title="请选择台账Excel文件", filters=[("Excel Files", "*.xlsx", "*.xls")], multiple=True)
             except ImportError: self.show_popup("功能缺失", "文件选择功能需要安装'plyer'库。\n请运行: pip install plyer")
     def handle_selection(self, selection):
-        if selection: self.excel_path_input.text = selection[0]
+        if selection: self.excel_path_input.text = '; '.join(selection)
     def open_android_file_chooser(self):
         try:
             intent = Intent(Intent.ACTION_OPEN_DOCUMENT); intent.addCategory(Intent.CATEGORY_OPENABLE); intent.setType("*/*")
             intent.addFlags(Intent.FLAG_GRANT_READ_URI_PERMISSION | Intent.FLAG_GRANT_PERSISTABLE_URI_PERMISSION)
+            intent.putExtra(Intent.EXTRA_ALLOW_MULTIPLE, True)
             PythonActivity.mActivity.startActivityForResult(intent, self.ACTIVITY_RESULT_FILE_PICKER)
         except Exception as e: self.show_popup("文件选择错误", f"无法打开文件选择器: {e}")
     def on_activity_result(self, request_code, result_code, intent):
@@ -266,11 +207,18 @@ class StartupScreen(Screen):
     def _process_activity_result(self, request_code, result_code, intent):
         if request_code != self.ACTIVITY_RESULT_FILE_PICKER or result_code != -1: return
         try:
-            uri = intent.getData()
-            if not uri: return
+            # 多选时文件在 ClipData 中, 单选时在 getData() 中
+            clip = intent.getClipData()
+            uris = [clip.getItemAt(i).getUri() for i in range(clip.getItemCount())] if clip else [intent.getData()]
+            uris = [uri for uri in uris if uri]
+            if not uris: return
             context = PythonActivity.mActivity.getApplicationContext()
-            context.getContentResolver().takePersistableUriPermission(uri, Intent.FLAG_GRANT_READ_URI_PERMISSION | Intent.FLAG_GRANT_WRITE_URI_PERMISSION)
-            self.copy_and_process_uri(uri)
+            local_paths = []
+            for uri in uris:
+                context.getContentResolver().takePersistableUriPermission(uri, Intent.FLAG_GRANT_READ_URI_PERMISSION | Intent.FLAG_GRANT_WRITE_URI_PERMISSION)
+                local_path = self.copy_and_process_uri(uri)
+                if local_path: local_paths.append(local_path)
+            if local_paths: self.excel_path_input.text = '; '.join(local_paths)
         except Exception as e: self.show_popup("文件处理错误", f"处理文件URI时出错: {e}\n{traceback.format_exc()}")
     def copy_and_process_uri(self, uri):
         try:
@@ -289,120 +237,263 @@ class StartupScreen(Screen):
                     length = input_stream.read(buffer)
                     if length == -1: break
                     output_stream.write(buffer, 0, length)
-            self.excel_path_input.text = local_path
+            return local_path
         except Exception as e: self.show_popup("文件复制错误", f"无法复制文件: {e}\n{traceback.format_exc()}")
     def start_app(self, instance):
-        excel_path = self.excel_path_input.text.strip()
-        if not os.path.exists(excel_path): self.show_popup("错误", f"文件不存在: {excel_path}"); return
+        if self.load_thread and self.load_thread.is_alive():
+            # 加载过程中再次点击按钮即取消
+            self.cancel_event.set(); self.add_log("正在取消加载..."); return
+        try:
+            sources = parse_ledger_sources(self.excel_path_input.text, all_sheets=self.all_sheets_checkbox.active)
+        except Exception as e: self.show_popup("错误", f"无法读取台账文件: {e}"); return
+        if not sources: self.show_popup("错误", "请先选择台账文件。"); return
+        missing = [path for path, _ in sources if not os.path.exists(path)]
+        if missing: self.show_popup("错误", f"文件不存在: {missing[0]}"); return
+        app = App.get_running_app()
+        if app.asset_db and set(sources) == set(app.asset_db.sources):
+            # 同一组台账: 只重新读取有变化的文件, 不必全部重建
+            if app.reload_ledger(self.on_ledger_reloaded): self.add_log("台账已加载, 正在检查文件是否更新...")
+            return
+        cache_dir = os.path.join(app.user_data_dir, 'ledger_cache')
+        self.cancel_event = threading.Event()
+        self.load_thread = threading.Thread(target=self.load_ledger, args=(sources, cache_dir, self.cancel_event), daemon=True)
+        self.start_btn.text = "取消加载"
+        self.add_log(f"开始加载台账: {', '.join(source_label(source) for source in sources)}")
+        self.load_thread.start()
+    def load_ledger(self, sources, cache_dir, cancel_event):
+        """Runs on the worker thread; every UI update goes through Clock.schedule_once."""
+        started = time.time()
+        def report(rows):
+            elapsed = time.time() - started
+            Clock.schedule_once(lambda dt: self.add_log(f"已解析 {rows} 行, 用时 {elapsed:.1f} 秒"))
+        try:
+            asset_db = AssetDatabase(sources, cache_dir=cache_dir, progress=report, cancel_event=cancel_event)
+            asset_db.search_keys()  # 边输入边查询用的排序后缀表, 在加载线程里建好
+        except LoadCancelled:
+            Clock.schedule_once(lambda dt: self.on_load_finished("已取消加载。")); return
+        except Exception as e:
+            message = f"加载Excel时发生错误: {e}\n{traceback.format_exc()}"
+            Clock.schedule_once(lambda dt: self.on_load_finished("台账加载失败。", error=message)); return
+        Clock.schedule_once(lambda dt: self.on_ledger_loaded(asset_db, time.time() - started, cancel_event))
+    def on_load_finished(self, log_message, error=None):
+        self.start_btn.text = "启动系统"; self.add_log(log_message)
+        if error: self.show_popup("启动错误", error)
+    def on_ledger_loaded(self, asset_db, elapsed, cancel_event):
+        if cancel_event.is_set(): self.on_load_finished("已取消加载。"); return
         try:
             app = App.get_running_app()
-            app.asset_db = AssetDatabase(excel_path)
-            app.data_manager = DataManager() # 初始化DataManager
+            app.asset_db = asset_db
+            self.on_load_finished(f"台账已加载 ({'缓存' if asset_db.from_cache else '解析Excel'}): {len(asset_db.sources)} 个来源, "
+                                  f"{len(asset_db.records)} 条记录, 用时 {elapsed:.1f} 秒")
+            if asset_db.duplicates:
+                examples = [f"  {asset}: {', '.join(labels)}" for asset, labels in list(asset_db.duplicates.items())[:5]]
+                self.add_log(f"注意: {len(asset_db.duplicates)} 个原表资产号在多个台账中重复, 例如:\n" + "\n".join(examples))
+            if app.write_queue: app.write_queue.close(timeout=10)
+            app.data_manager = create_data_manager(app.user_data_dir, on_error=show_popup_global) # 初始化DataManager
+            app.write_queue = WriteBehindQueue(app.data_manager, on_error=app.on_write_error)
+            # 查重索引 (含历史文件) 在后台建好, 第一次保存时无需等待
+            threading.Thread(target=app.data_manager.prepare_duplicate_index, daemon=True).start()
+            app.archive = DailyArchive(app.data_manager, os.path.join(app.user_data_dir, 'archive_cache'))
+            # 统计只在这里从存储读取一次, 之后随每次保存/修改/删除更新; 写入线程里只触发界面刷新
+            app.daily_stats = DailyStats(app.data_manager, on_change=self.manager.get_screen('main').stats_trigger)
+            if SYNC_URL: app.start_sync(SYNC_URL)
+            metrics.set_output_dir(app.data_manager.get_output_dir()); self.log_metrics()
             self.manager.get_screen('main').reset_session()
             self.manager.current = 'main'
         except Exception as e: self.show_popup("启动错误", f"加载Excel时发生错误: {e}\n{traceback.format_exc()}")
+    def on_ledger_reloaded(self, message, error=None):
+        self.add_log(message)
+        if error: self.show_popup("更新台账", error); return
+        self.manager.current = 'main'
+    def log_metrics(self):
+        """Shows the timings gathered since the last flush, then appends them to the metrics file."""
+        if not metrics.enabled: return
+        lines = metrics.summary()
+        if not lines: return
+        self.add_log("性能统计:\n  " + "\n  ".join(lines))
+        try: metrics.flush()
+        except OSError as e: self.add_log(f"性能统计写入失败: {e}")
     def show_popup(self, title, message): show_popup_global(title, message)
 
 class MainScreen(Screen):
+    SEARCH_DELAY = 0.15      # 停止输入多久后开始查询 (秒)
+    MIN_SEARCH_CHARS = 2
+    SEARCH_LIMIT = 8         # 候选列表最多显示几条
+    MAX_DUPLICATE_CHOICES = 50
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.current_count = 0; self.state = 'INPUT'; self.user_info = {}
+        self.search_trigger = Clock.create_trigger(self.run_live_search, self.SEARCH_DELAY)
+        self.stats_trigger = Clock.create_trigger(lambda dt: self.update_daily_count())
+        self.batch = None  # 批量查询的结果 (BatchLookup), 逐条录入时使用
+        # 标题、页脚只创建一次; 三个状态的界面第一次用到时创建, 之后切换时只更新内容
+        self.views = {}; self.current_view = None
         self.layout = BoxLayout(orientation='vertical', padding='20dp', spacing='20dp')
+        header = BoxLayout(orientation='vertical', size_hint_y=None, height='60dp')
+        title = ThemedLabel(text="数据录入", font_size='24sp', bold=True)
+        stats_row = BoxLayout(spacing='10dp')
+        self.stats_label = ThemedLabel(text=self.stats_text(), font_size='14sp', color=C["text_secondary"])
+        summary_btn = Button(text='今日统计', size_hint_x=0.3, font_size='13sp', background_normal='', background_color=C["text_secondary"])
+        summary_btn.bind(on_press=self.show_daily_summary)
+        stats_row.add_widget(self.stats_label); stats_row.add_widget(summary_btn)
+        header.add_widget(title); header.add_widget(stats_row); self.layout.add_widget(header)
+        self.body = BoxLayout()
+        self.layout.add_widget(self.body)
+        footer_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
+        back_to_start_btn = ThemedButton(text="返回首页"); back_to_start_btn.bind(on_press=self.back_to_start)
+        footer_layout.add_widget(back_to_start_btn)
+        edit_data_btn = ThemedButton(text="管理当日数据"); edit_data_btn.bind(on_press=self.go_to_edit_screen)
+        footer_layout.add_widget(edit_data_btn)
+        reload_btn = ThemedButton(text="更新台账"); reload_btn.bind(on_press=self.reload_ledger)
+        footer_layout.add_widget(reload_btn)
+        self.layout.add_widget(footer_layout)
         self.add_widget(self.layout)
     def on_enter(self, *args):
         self.reset_session()
         self.update_ui_for_state()
+    def on_leave(self, *args):
+        App.get_running_app().compact_data()
     def reset_session(self):
         self.state = 'INPUT'
         self.update_daily_count()
+    @instrumented('ui.daily_count')
     def update_daily_count(self):
-        try:
-            df = App.get_running_app().data_manager.load_daily_data()
-            self.current_count = len(df)
-            if hasattr(self, 'stats_label'):
-                self.stats_label.text = f'本日已录入: {self.current_count} 条'
-        except Exception:
-            self.current_count = 0
+        stats = App.get_running_app().daily_stats
+        self.current_count = stats.snapshot()['count'] if stats else 0
+        self.stats_label.text = self.stats_text()
+    def show_daily_summary(self, instance):
+        stats = App.get_running_app().daily_stats
+        if not stats: return
+        snapshot = stats.snapshot()
+        lines = [f"{snapshot['day']} 共录入 {snapshot['count']} 条", '']
+        for col in DailyStats.COLUMNS:
+            lines.append(f"[b]{col}:[/b] " + ('  '.join(f"{value or '未填'} {n}" for value, n in snapshot[col].items()) or '无'))
+        lines += ['', '[b]按小时:[/b]']
+        peak = max(snapshot['hours'].values(), default=0)
+        for hour, n in snapshot['hours'].items():
+            bar = '■' * max(1, round(n * 20 / peak))
+            lines.append(f"  {hour or '--'}时  {n:>4}  {bar}")
+        content = BoxLayout(orientation='vertical', padding='10dp', spacing='10dp')
+        scroll = ScrollView()
+        label = ThemedLabel(text="\n".join(lines), markup=True, halign='left', valign='top', size_hint_y=None, line_height=1.3)
+        label.bind(width=lambda *x: label.setter('text_size')(label, (label.width, None)),
+                   texture_size=lambda *x: label.setter('height')(label, label.texture_size[1]))
+        scroll.add_widget(label); content.add_widget(scroll)
+        close_btn = ThemedButton(text='关闭', size_hint_y=None, height='44dp'); content.add_widget(close_btn)
+        popup = Popup(title="今日统计", content=content, size_hint=(0.9, 0.8))
+        close_btn.bind(on_press=popup.dismiss)
+        popup.open()
 
+    @instrumented('ui.main_switch')
     def update_ui_for_state(self):
-        self.layout.clear_widgets()
-        header = BoxLayout(orientation='vertical', size_hint_y=None, height='60dp')
-        title = ThemedLabel(text="数据录入", font_size='24sp', bold=True)
-        self.stats_label = ThemedLabel(text=f'本日已录入: {self.current_count} 条', font_size='14sp', color=C["text_secondary"])
-        header.add_widget(title); header.add_widget(self.stats_label); self.layout.add_widget(header)
-        
-        if self.state == 'INPUT': self.build_input_ui()
-        elif self.state == 'VERIFY': self.build_verification_ui()
-        elif self.state == 'FORM': self.build_form_ui()
-        
-        footer_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
-        back_to_start_btn = ThemedButton(text="返回首页"); back_to_start_btn.bind(on_press=self.back_to_start)
-        footer_layout.add_widget(back_to_start_btn)
-        
-        edit_data_btn = ThemedButton(text="管理当日数据"); edit_data_btn.bind(on_press=self.go_to_edit_screen)
-        footer_layout.add_widget(edit_data_btn)
-        
-        self.layout.add_widget(footer_layout)
-        
+        """Shows the prebuilt view of the current state after rebinding its dynamic fields."""
+        if self.state not in self.views:
+            builders = {'INPUT': self.build_input_ui, 'VERIFY': self.build_verification_ui, 'FORM': self.build_form_ui}
+            self.views[self.state] = builders[self.state]()
+        view = self.views[self.state]
+        {'INPUT': self.bind_input_ui, 'VERIFY': self.bind_verification_ui, 'FORM': self.bind_form_ui}[self.state]()
+        self.stats_label.text = self.stats_text()
+        if self.current_view is not view:
+            self.body.clear_widgets(); self.body.add_widget(view)
+            self.current_view = view
+
     def build_input_ui(self):
         scroll_view = ScrollView(size_hint=(1, 1)); card = Card()
         card.add_widget(ThemedLabel(text="输入原表资产号后6位进行查询:", size_hint_y=None, height='30dp'))
         self.asset_input = ThemedTextInput(multiline=False, size_hint_y=None, height='44dp', hint_text='例如: 123456', font_size='16sp')
-        self.asset_input.focus = True; card.add_widget(self.asset_input)
+        card.add_widget(self.asset_input)
+        self.asset_input.bind(text=lambda *x: self.search_trigger())
+        # 候选按钮只创建一次, 输入变化时改写文字并显示/隐藏
+        self.search_hint = ThemedLabel(text='', font_size='13sp', color=C["text_secondary"], size_hint_y=None, height=0)
+        card.add_widget(self.search_hint)
+        candidates = GridLayout(cols=1, size_hint_y=None); candidates.bind(minimum_height=candidates.setter('height'))
+        self.candidate_buttons = []
+        for _ in range(self.SEARCH_LIMIT):
+            btn = Button(size_hint_y=None, height=0, opacity=0, disabled=True, halign='left', font_size='14sp',
+                         background_normal='', background_color=C["background"], color=C["text"])
+            btn.bind(width=lambda b, w: setattr(b, 'text_size', (w - dp(20), None)), on_press=self.pick_candidate)
+            candidates.add_widget(btn); self.candidate_buttons.append(btn)
+        card.add_widget(candidates)
         submit_btn = ThemedButton(text='提交查询', size_hint_y=None, height='44dp'); submit_btn.bind(on_press=self.check_asset)
-        card.add_widget(submit_btn); scroll_view.add_widget(card); self.layout.add_widget(scroll_view)
+        card.add_widget(submit_btn)
+        # 批量录入进行中/未开始时显示不同的按钮, 两组都预先建好
+        self.batch_slot = BoxLayout(orientation='vertical', size_hint_y=None, spacing='15dp')
+        self.batch_slot.bind(minimum_height=self.batch_slot.setter('height'))
+        card.add_widget(self.batch_slot)
+        self.batch_active = BoxLayout(orientation='vertical', size_hint_y=None, height='89dp', spacing='15dp')
+        self.batch_label = ThemedLabel(text='', color=C["accent"], size_hint_y=None, height='30dp')
+        self.batch_active.add_widget(self.batch_label)
+        batch_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
+        resume_btn = ThemedButton(text='继续批量录入'); resume_btn.bind(on_press=lambda x: self.next_batch_record())
+        end_btn = Button(text='结束批量', background_color=C["text_secondary"], background_normal=''); end_btn.bind(on_press=self.end_batch)
+        batch_layout.add_widget(resume_btn); batch_layout.add_widget(end_btn); self.batch_active.add_widget(batch_layout)
+        self.batch_btn = ThemedButton(text='批量查询 (粘贴列表)', size_hint_y=None, height='44dp'); self.batch_btn.bind(on_press=self.open_batch_popup)
+        scroll_view.add_widget(card)
+        return scroll_view
+    def bind_input_ui(self):
+        self.asset_input.text = ""
+        widget = self.batch_active if self.batch else self.batch_btn
+        if self.batch:
+            self.batch_label.text = f"批量录入进行中, 剩余 {self.batch.remaining} 条" + (f", 已跳过 {len(self.batch.skipped)} 条" if self.batch.skipped else '')
+        if widget.parent is not self.batch_slot:
+            self.batch_slot.clear_widgets(); self.batch_slot.add_widget(widget)
+        self.asset_input.focus = True
     def build_verification_ui(self):
         scroll_view = ScrollView(size_hint=(1, 1)); card = Card()
-        user_text = (f"[b]客户号:[/b] {self.user_info.get('客户号', 'N/A')}\n"
-                     f"[b]用户名:[/b] {self.user_info.get('用户名', 'N/A')}\n"
-                     f"[b]原表资产号:[/b] {self.user_info.get('原表资产号', 'N/A')}")
-        info_label = ThemedLabel(text=user_text, markup=True, line_height=1.5, size_hint_y=None)
+        self.info_label = info_label = ThemedLabel(text='', markup=True, line_height=1.5, size_hint_y=None)
         info_label.bind(width=lambda *x: info_label.setter('text_size')(info_label, (info_label.width, None)))
         info_label.bind(texture_size=lambda *x: info_label.setter('height')(info_label, info_label.texture_size[1]))
         card.add_widget(info_label)
         card.add_widget(ThemedLabel(text='请核对以上信息是否正确?', color=C["accent"], bold=True, size_hint_y=None, height='44dp'))
         btn_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
         correct_btn = ThemedButton(text='正确, 下一步'); correct_btn.bind(on_press=lambda x: self.change_state('FORM'))
-        incorrect_btn = Button(text='错误, 返回', background_color=C["text_secondary"], background_normal=''); incorrect_btn.bind(on_press=lambda x: self.change_state('INPUT'))
+        incorrect_btn = Button(text='错误, 返回', background_color=C["text_secondary"], background_normal=''); incorrect_btn.bind(on_press=lambda x: self.advance())
         btn_layout.add_widget(correct_btn); btn_layout.add_widget(incorrect_btn); card.add_widget(btn_layout)
-        scroll_view.add_widget(card); self.layout.add_widget(scroll_view)
+        scroll_view.add_widget(card)
+        return scroll_view
+    def bind_verification_ui(self):
+        user_text = (f"[b]客户号:[/b] {self.user_info.get('客户号', 'N/A')}\n"
+                     f"[b]用户名:[/b] {self.user_info.get('用户名', 'N/A')}\n"
+                     f"[b]原表资产号:[/b] {self.user_info.get('原表资产号', 'N/A')}")
+        if len(App.get_running_app().asset_db.sources) > 1:
+            user_text += f"\n[b]台账:[/b] {getattr(self.user_info, 'source', '')}"
+        self.info_label.text = user_text
 
+    # (输入框名, 标签) 以及每次进入表单时恢复的默认值; 原表表码 的默认值来自台账
+    FORM_FIELDS = [('old_meter', '原表表码'), ('new_asset', '新资产号'), ('seal_number', '铅封号'),
+                   ('material_usage', '材料使用'), ('remark', '备注')]
+    FORM_DEFAULTS = {'meter_type': '单相表', 'box_type': '利旧未换'}
     def build_form_ui(self):
         form_container = BoxLayout(orientation='vertical', spacing='10dp')
         scroll_view = ScrollView(size_hint=(1, 1))
         card = Card()
-        
-        header_text = (f"正在为 [b]{self.user_info.get('用户名', '')}[/b] 录入新表信息\n"
-                       f"原资产号: {self.user_info.get('原表资产号', 'N/A')}")
-        card.add_widget(ThemedLabel(text=header_text, markup=True, size_hint_y=None, height='60dp', line_height=1.4))
-        
+
+        self.form_header = ThemedLabel(text='', markup=True, size_hint_y=None, height='60dp', line_height=1.4)
+        card.add_widget(self.form_header)
+
         form_layout = GridLayout(cols=1, spacing='10dp', size_hint_y=None)
         form_layout.bind(minimum_height=form_layout.setter('height'))
         self.inputs = {}
-        fields = [
-            ('原表表码', 'old_meter', str(self.user_info.get('原表表码', ''))), ('新资产号', 'new_asset', ''),
-            ('铅封号', 'seal_number', ''), ('材料使用', 'material_usage', ''), ('备注', 'remark', '')
-        ]
-        for label_text, name, default in fields:
+        for name, label_text in self.FORM_FIELDS:
             form_layout.add_widget(ThemedLabel(text=label_text, halign='left', size_hint_y=None, height='20dp'))
-            inp = ThemedTextInput(text=default, multiline=False, size_hint_y=None, height='44dp')
+            inp = ThemedTextInput(multiline=False, size_hint_y=None, height='44dp')
             self.inputs[name] = inp
             form_layout.add_widget(inp)
         form_layout.add_widget(ThemedLabel(text='表计类型', halign='left', size_hint_y=None, height='20dp'))
-        
+
         self.inputs['meter_type'] = Spinner(
-            text='单相表', values=('单相表', '三相表'), size_hint_y=None, height='44dp', 
+            text='单相表', values=('单相表', '三相表'), size_hint_y=None, height='44dp',
             background_color=C["accent"]
         )
         form_layout.add_widget(self.inputs['meter_type'])
-      
+
         form_layout.add_widget(ThemedLabel(text='表箱类型', halign='left', size_hint_y=None, height='20dp'))
         self.inputs['box_type'] = Spinner(
             text='利旧未换', values=('利旧未换', '单位', '双位', '双位单装'),
             size_hint_y=None, height='44dp', background_color=C["accent"]
         )
         form_layout.add_widget(self.inputs['box_type'])
-        
+
         card.add_widget(form_layout)
         scroll_view.add_widget(card)
         form_container.add_widget(scroll_view)
@@ -412,9 +503,24 @@ class MainScreen(Screen):
         back_btn = Button(text='返回上一步', background_color=C["text_secondary"], background_normal=''); back_btn.bind(on_press=lambda x: self.change_state('VERIFY'))
         btn_layout.add_widget(back_btn)
         form_container.add_widget(btn_layout)
-        self.layout.add_widget(form_container)
+        self.form_scroll = scroll_view
+        return form_container
+    def bind_form_ui(self):
+        self.form_header.text = (f"正在为 [b]{self.user_info.get('用户名', '')}[/b] 录入新表信息\n"
+                                 f"原资产号: {self.user_info.get('原表资产号', 'N/A')}")
+        for name, _ in self.FORM_FIELDS: self.inputs[name].text = ''
+        self.inputs['old_meter'].text = str(self.user_info.get('原表表码', ''))
+        for name, default in self.FORM_DEFAULTS.items(): self.inputs[name].text = default
+        self.form_scroll.scroll_y = 1
 
     def change_state(self, new_state):
+        if metrics.enabled:
+            # 从切换开始到新界面画到屏幕上 (下一次 flip) 的用时
+            started = time.perf_counter()
+            def on_flip(*args):
+                Window.unbind(on_flip=on_flip)
+                metrics.observe(f'ui.transition.{new_state.lower()}', time.perf_counter() - started)
+            Window.bind(on_flip=on_flip)
         self.state = new_state
         self.update_ui_for_state()
 
@@ -422,6 +528,33 @@ class MainScreen(Screen):
         self.manager.current = 'edit'
 
     def back_to_start(self, instance): self.manager.current = 'start'
+    def reload_ledger(self, instance):
+        # 在后台更新, 旧台账照常查询; 正在核对/录入的 user_info 仍指向旧记录, 不受影响
+        if App.get_running_app().reload_ledger(lambda message, error=None: self.show_popup("更新台账", error or message)):
+            self.show_popup("更新台账", "正在检查台账文件是否更新, 可继续录入。")
+    @instrumented('ui.live_search')
+    def run_live_search(self, dt):
+        if self.state != 'INPUT': return
+        typed = self.asset_input.text.strip()
+        records, total = App.get_running_app().asset_db.search(typed, self.SEARCH_LIMIT) if len(typed) >= self.MIN_SEARCH_CHARS else ([], 0)
+        for btn, record in itertools.zip_longest(self.candidate_buttons, records):
+            btn.record = record
+            if record is None:
+                btn.height, btn.opacity, btn.disabled = 0, 0, True
+                continue
+            btn.text = f"{record['原表资产号']}  {record['用户名']}"
+            btn.height, btn.opacity, btn.disabled = dp(40), 1, False
+        if len(typed) < self.MIN_SEARCH_CHARS: hint = ''
+        elif not records: hint = f"没有以 '{typed}' 开头的后6位"
+        elif total > len(records): hint = f"{total} 个后缀匹配, 继续输入以缩小范围"
+        else: hint = ''
+        self.search_hint.text = hint
+        self.search_hint.height = dp(20) if hint else 0
+    def pick_candidate(self, instance):
+        if instance.record is None: return
+        self.user_info = instance.record
+        self.asset_input.text = ""
+        self.change_state('VERIFY')
     def check_asset(self, instance):
         last_6_digits = self.asset_input.text.strip()
         if not last_6_digits: self.show_popup("输入错误", "资产号不能为空。"); return
@@ -430,12 +563,16 @@ class MainScreen(Screen):
         if not matches: self.show_popup("未找到记录", f"数据库中不存在以 '{last_6_digits}' 结尾的资产号。")
         elif len(matches) == 1: self.user_info = matches[0]; self.change_state('VERIFY')
         else: self.show_duplicate_selection_popup(matches)
-    def show_duplicate_selection_popup(self, matches):
+    def show_duplicate_selection_popup(self, matches, batch_suffix=None):
         content = GridLayout(cols=1, spacing='10dp', size_hint_y=None)
         content.bind(minimum_height=content.setter('height'))
         content.add_widget(ThemedLabel(text="发现多条重复数据，请选择正确的一条:", size_hint_y=None, height='44dp'))
-        for record in matches:
+        if len(matches) > self.MAX_DUPLICATE_CHOICES:
+            content.add_widget(ThemedLabel(text=f"共 {len(matches)} 条, 仅显示前 {self.MAX_DUPLICATE_CHOICES} 条, 请输入更多位数",
+                                           color=C["accent"], size_hint_y=None, height='30dp'))
+        for record in matches[:self.MAX_DUPLICATE_CHOICES]:
             display_text = f"客户号: {record['客户号']} | 用户名: {record['用户名']}\n资产号: {record['原表资产号']}"
+            if len(App.get_running_app().asset_db.sources) > 1: display_text += f" | 台账: {record.source}"
             btn = ThemedButton(text=display_text, size_hint_y=None, height='60dp', text_size=(Window.width * 0.7, None), halign='center')
             btn.bind(on_press=partial(self.select_duplicate, record)); content.add_widget(btn)
         scroll = ScrollView(); scroll.add_widget(content)
@@ -443,11 +580,92 @@ class MainScreen(Screen):
             title="选择重复数据", title_color=C["primary"], content=scroll, size_hint=(0.9, 0.8),
             background='', background_color=C["card"]
         )
+        self.duplicate_choice = None
+        # 批量录入中没有选择就关闭: 记为跳过并提示, 批量结束时列出
+        if batch_suffix: self.popup.bind(on_dismiss=lambda popup: self.skip_batch_record(batch_suffix) if self.duplicate_choice is None else None)
         self.popup.open()
     def select_duplicate(self, record, instance):
+        self.duplicate_choice = record
         self.popup.dismiss(); self.user_info = record; self.change_state('VERIFY')
+    def skip_batch_record(self, suffix):
+        if not self.batch: return
+        self.batch.skip(suffix); self.bind_input_ui()
+        self.show_popup("已跳过", f"{suffix} 没有选择记录, 未录入。\n批量结束时会列出所有跳过的资产号; 点击\"继续批量录入\"处理下一条。")
+
+    def stats_text(self):
+        text = f'本日已录入: {self.current_count} 条'
+        if self.batch: text += f' | 批量剩余: {self.batch.remaining} 条'
+        return text
+    def open_batch_popup(self, instance):
+        content = BoxLayout(orientation='vertical', spacing='10dp', padding='10dp')
+        content.add_widget(ThemedLabel(text="每行一个资产号后缀 (也可用空格或逗号分隔):", size_hint_y=None, height='30dp'))
+        list_input = ThemedTextInput(multiline=True, hint_text='例如:\n123456\n234567')
+        content.add_widget(list_input)
+        btn_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
+        if platform != 'android':
+            file_btn = ThemedButton(text='读取文本文件'); file_btn.bind(on_press=lambda x: self.choose_batch_file(list_input))
+            btn_layout.add_widget(file_btn)
+        lookup_btn = ThemedButton(text='查询'); btn_layout.add_widget(lookup_btn)
+        cancel_btn = Button(text='取消', background_color=C["text_secondary"], background_normal=''); btn_layout.add_widget(cancel_btn)
+        content.add_widget(btn_layout)
+        popup = Popup(title="批量查询", title_color=C["primary"], content=content, size_hint=(0.9, 0.8),
+                      background='', background_color=C["card"])
+        lookup_btn.bind(on_press=lambda x: (popup.dismiss(), self.run_batch_lookup(list_input.text)))
+        cancel_btn.bind(on_press=popup.dismiss)
+        popup.open()
+    def choose_batch_file(self, list_input):
+        def load(selection):
+            if not selection: return
+            try:
+                with open(selection[0], encoding='utf-8-sig') as f: text = f.read()
+            except (OSError, UnicodeDecodeError) as e: self.show_popup("读取失败", f"无法读取文件: {e}"); return
+            Clock.schedule_once(lambda dt: setattr(list_input, 'text', text))
+        try:
+            from plyer import filechooser
+            filechooser.open_file(on_selection=load, title="请选择资产号列表", filters=[("Text Files", "*.txt", "*.csv")])
+        except ImportError: self.show_popup("功能缺失", "文件选择功能需要安装'plyer'库。\n请运行: pip install plyer")
+    def run_batch_lookup(self, text):
+        suffixes = parse_suffix_list(text)
+        if not suffixes: self.show_popup("输入错误", "列表中没有资产号。"); return
+        batch = App.get_running_app().asset_db.lookup_many(suffixes)
+        content = BoxLayout(orientation='vertical', spacing='10dp', padding='10dp')
+        details = [batch.summary()]
+        if batch.multiple: details.append("多条匹配 (录入时选择): " + ', '.join(batch.multiple))
+        if batch.misses: details.append("未找到: " + ', '.join(batch.misses))
+        detail_label = ThemedLabel(text='\n\n'.join(details), size_hint_y=None, halign='left', valign='top')
+        detail_label.bind(width=lambda *x: detail_label.setter('text_size')(detail_label, (detail_label.width, None)))
+        detail_label.bind(texture_size=lambda *x: detail_label.setter('height')(detail_label, detail_label.texture_size[1]))
+        scroll = ScrollView(); scroll.add_widget(detail_label); content.add_widget(scroll)
+        btn_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
+        start_btn = ThemedButton(text=f'开始录入 ({len(batch.staged)} 条)', disabled=not batch.staged)
+        close_btn = Button(text='关闭', background_color=C["text_secondary"], background_normal='')
+        btn_layout.add_widget(start_btn); btn_layout.add_widget(close_btn); content.add_widget(btn_layout)
+        popup = Popup(title="批量查询结果", title_color=C["primary"], content=content, size_hint=(0.9, 0.8),
+                      background='', background_color=C["card"])
+        start_btn.bind(on_press=lambda x: (popup.dismiss(), self.start_batch(batch)))
+        close_btn.bind(on_press=popup.dismiss)
+        popup.open()
+    def start_batch(self, batch):
+        self.batch = batch
+        self.next_batch_record()
+    def next_batch_record(self):
+        """Opens the next staged meter: straight to VERIFY for a unique hit, the selection popup otherwise."""
+        item = self.batch.next() if self.batch else None
+        if item is None:
+            if self.batch: self.show_popup("批量录入完成", self.batch.summary())
+            self.batch = None; self.change_state('INPUT'); return
+        suffix, matches = item
+        if len(matches) == 1: self.user_info = matches[0]; self.change_state('VERIFY')
+        else: self.change_state('INPUT'); self.show_duplicate_selection_popup(matches, batch_suffix=suffix)
+    def end_batch(self, instance):
+        if self.batch and self.batch.skipped: self.show_popup("批量录入结束", self.batch.summary())
+        self.batch = None; self.change_state('INPUT')
+    def advance(self):
+        """After saving or rejecting a record: next meter of the batch, or back to the query."""
+        if self.batch: self.next_batch_record()
+        else: self.change_state('INPUT')
         
-    def save_data(self, instance):
+    def save_data(self, instance, confirmed=False):
         data = {'客户号': self.user_info.get('客户号', ''), '用户名': self.user_info.get('用户名', ''),
                 '原表资产号': self.user_info.get('原表资产号', ''), '原表表码': self.inputs['old_meter'].text,
                 '新资产号': self.inputs['new_asset'].text, '铅封号': self.inputs['seal_number'].text,
@@ -455,86 +673,196 @@ class MainScreen(Screen):
                 '安装人员': INSTALLER_NAMES, '材料使用': self.inputs['material_usage'].text, '备注': self.inputs['remark'].text,
                 '录入时间': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
         
-        dm = App.get_running_app().data_manager
-        output_file = dm.get_output_path()
+        app = App.get_running_app()
+        output_file = app.data_manager.get_output_path()
 
         try:
-            dm.append_data(data)
-            self.update_daily_count()
-            self.show_popup("保存成功", f"数据已成功保存！\n文件路径:\n{output_file}")
-            self.change_state('INPUT')
-        except PermissionError: self.show_popup("保存错误", f"无法写入文件！\n请检查应用权限或关闭已打开的Excel文件:\n{output_file}")
+            if not confirmed:
+                # 刚提交的记录可能还在写入队列中, 先写入再查重
+                if app.write_queue.pending(): app.flush_writes()
+                if not app.data_manager.duplicate_index_ready():
+                    # 查重索引还在后台建立: 在后台等它建好再保存, 不在界面线程中读取历史文件
+                    instance.disabled = True
+                    def wait_for_index():
+                        try:
+                            app.data_manager.prepare_duplicate_index()
+                            Clock.schedule_once(lambda dt: (setattr(instance, 'disabled', False), self.save_data(instance)))
+                        except Exception as e:
+                            message = f"建立查重索引时发生错误: {e}"
+                            Clock.schedule_once(lambda dt: (setattr(instance, 'disabled', False), self.show_popup("保存错误", message)))
+                    threading.Thread(target=wait_for_index, daemon=True).start(); return
+                duplicates = app.data_manager.find_duplicates(data)
+                if duplicates: self.confirm_duplicate_save(duplicates, instance); return
+            # 记录交给后台线程写入, 写入失败时由 app.on_write_error 提示
+            seq = app.write_queue.submit(data)  # 写入后 daily_stats 会触发 stats_trigger 刷新计数
+            self.show_popup("保存成功", f"数据已提交保存 (序号 {seq})！\n文件路径:\n{output_file}")
+            self.advance()
         except Exception as e: self.show_popup("未知错误", f"保存数据时发生错误: {str(e)}\n{traceback.format_exc()}")
-        
+
+    def confirm_duplicate_save(self, duplicates, instance):
+        lines = [f"{col} {value} 已录入过 ({', '.join(places[:3])}{' 等' if len(places) > 3 else ''})" for col, value, places in duplicates]
+        content = BoxLayout(orientation='vertical', padding='10dp', spacing='10dp')
+        content.add_widget(ThemedLabel(text="\n".join(lines) + "\n\n确定仍要保存吗？"))
+        btn_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
+        confirm_btn = Button(text='仍然保存', background_color=C["error"], background_normal='')
+        cancel_btn = ThemedButton(text='返回修改')
+        btn_layout.add_widget(confirm_btn); btn_layout.add_widget(cancel_btn)
+        content.add_widget(btn_layout)
+        popup = Popup(title="发现重复数据", content=content, size_hint=(0.9, 0.5), title_color=C["error"])
+        confirm_btn.bind(on_press=lambda x: (popup.dismiss(), self.save_data(instance, confirmed=True)))
+        cancel_btn.bind(on_press=popup.dismiss)
+        popup.open()
+
     def show_popup(self, title, message): show_popup_global(title, message)
 
 
 # ==================== EditScreen (New Screen) ====================
+class RecordRow(RecycleDataViewBehavior, BoxLayout):
+    """One recycled row of the EditScreen list; its widgets are built once and rebound per record."""
+    row_id = ObjectProperty(None, allownone=True)
+    record = ObjectProperty(None, allownone=True)
+    screen = ObjectProperty(None, allownone=True)
+    info_text = StringProperty('')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.orientation = 'vertical'; self.padding = '15dp'; self.spacing = '10dp'
+        with self.canvas.before:
+            from kivy.graphics import Color, RoundedRectangle
+            Color(*C["card"])
+            self.rect = RoundedRectangle(radius=[(10, 10)] * 4)
+        self.bind(pos=self.update_rect, size=self.update_rect)
+
+        self.info_label = ThemedLabel(markup=True, halign='left', valign='middle')
+        self.info_label.bind(size=lambda *x: self.info_label.setter('text_size')(self.info_label, self.info_label.size))
+        self.bind(info_text=self.info_label.setter('text'))
+        self.add_widget(self.info_label)
+
+        btn_layout = BoxLayout(size_hint_y=None, height='40dp', spacing='10dp')
+        edit_btn = ThemedButton(text="修改")
+        edit_btn.bind(on_press=lambda x: self.screen.show_edit_popup(self.row_id, self.record, x))
+        delete_btn = Button(text="删除", background_color=C["error"], background_normal='')
+        delete_btn.bind(on_press=lambda x: self.screen.confirm_delete(self.row_id, x))
+        btn_layout.add_widget(edit_btn)
+        btn_layout.add_widget(delete_btn)
+        self.add_widget(btn_layout)
+
+    def update_rect(self, *args):
+        self.rect.pos = self.pos; self.rect.size = self.size
+
 class EditScreen(Screen):
+    ROW_HEIGHT = dp(130)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.layout = BoxLayout(orientation='vertical', padding='20dp', spacing='20dp')
-        self.data_grid = None
+        self.record_list = None
+        self.rows = {}  # record_id -> 该行在 record_list.data 中的条目
+        self.only_problems = False
+        self.validator = None
+        self.dup_counts = {}  # 重复检查用: 列 -> 当天各值出现的次数
+        self.problem_rows = set()
         self.add_widget(self.layout)
 
     def on_enter(self, *args):
         self.populate_data()
 
+    @instrumented('ui.edit_populate')
     def populate_data(self):
         self.layout.clear_widgets()
 
-        header = BoxLayout(orientation='vertical', size_hint_y=None, height='60dp')
+        header = BoxLayout(orientation='vertical', size_hint_y=None, height='90dp')
         title = ThemedLabel(text="管理当日数据", font_size='24sp', bold=True)
         header.add_widget(title)
+        check_row = BoxLayout(size_hint_y=None, height='34dp', spacing='10dp')
+        self.problem_label = ThemedLabel(text='', font_size='14sp', color=C["text_secondary"])
+        self.filter_btn = ThemedButton(text=self.filter_text(), size_hint_x=0.35, font_size='13sp'); self.filter_btn.bind(on_press=self.toggle_problem_filter)
+        check_row.add_widget(self.problem_label); check_row.add_widget(self.filter_btn)
+        header.add_widget(check_row)
         self.layout.add_widget(header)
 
-        scroll_view = ScrollView(size_hint=(1, 1), do_scroll_x=False)
-        self.data_grid = GridLayout(cols=1, spacing='10dp', size_hint_y=None)
-        self.data_grid.bind(minimum_height=self.data_grid.setter('height'))
+        # 只为可见的行创建控件, 滚动时复用
+        self.record_list = RecycleView(size_hint=(1, 1), do_scroll_x=False)
+        rows_layout = RecycleBoxLayout(orientation='vertical', spacing='10dp', size_hint_y=None,
+                                       default_size=(None, self.ROW_HEIGHT), default_size_hint=(1, None))
+        rows_layout.bind(minimum_height=rows_layout.setter('height'))
+        self.record_list.add_widget(rows_layout)
+        self.record_list.viewclass = RecordRow
 
         try:
-            dm = App.get_running_app().data_manager
-            df = dm.load_daily_data()
+            app = App.get_running_app(); app.flush_writes()
+            records = app.data_manager.load_records()
 
-            if df.empty:
-                self.data_grid.add_widget(ThemedLabel(text="今天还没有录入任何数据。", size_hint_y=None, height='50dp'))
+            if not records:
+                self.layout.add_widget(ThemedLabel(text="今天还没有录入任何数据。"))
             else:
-                for index, row in df.iterrows():
-                    record_card = self.create_record_card(index, row)
-                    self.data_grid.add_widget(record_card)
+                # 校验器只在列表加载时创建一次, 之后修改或删除只复查受影响的行
+                self.validator = RecordValidator(app.asset_db, RecordValidator.load_rules(app.data_manager.get_output_dir()))
+                self.dup_counts = self.validator.duplicate_counts(records.values())
+                problems = self.validator.validate(records, self.dup_counts)
+                self.rows = {row_id: self.row_view_data(row_id, record, problems.get(row_id, ())) for row_id, record in records.items()}
+                self.problem_rows = set(problems)
+                self.show_problem_count()
+                self.record_list.data = self.visible_rows()
+                self.layout.add_widget(self.record_list)
         except Exception as e:
-            self.data_grid.add_widget(ThemedLabel(text=f"加载数据失败: {e}", size_hint_y=None, height='50dp'))
-
-        scroll_view.add_widget(self.data_grid)
-        self.layout.add_widget(scroll_view)
+            self.layout.add_widget(ThemedLabel(text=f"加载数据失败: {e}"))
 
         footer_layout = BoxLayout(size_hint_y=None, height='44dp', spacing='10dp')
         back_btn = ThemedButton(text="返回录入界面"); back_btn.bind(on_press=self.back_to_main)
         refresh_btn = ThemedButton(text="刷新列表"); refresh_btn.bind(on_press=lambda x: self.populate_data())
+        export_btn = ThemedButton(text="导出Excel"); export_btn.bind(on_press=self.export_data)
+        month_btn = ThemedButton(text="月度汇总"); month_btn.bind(on_press=self.export_month)
         footer_layout.add_widget(back_btn)
         footer_layout.add_widget(refresh_btn)
+        footer_layout.add_widget(export_btn)
+        footer_layout.add_widget(month_btn)
         self.layout.add_widget(footer_layout)
 
-    def create_record_card(self, index, row):
-        card = Card(padding='15dp')
-        
-        info_text = (f"[b]用户:[/b] {row.get('用户名', '')} ([b]原资产号:[/b] {row.get('原表资产号', '')})\n"
-                     f"[b]新资产号:[/b] {row.get('新资产号', '')} | [b]铅封号:[/b] {row.get('铅封号', '')}")
-        info_label = ThemedLabel(text=info_text, markup=True, size_hint_y=None)
-        info_label.bind(width=lambda *x: info_label.setter('text_size')(info_label, (info_label.width, None)))
-        info_label.bind(texture_size=lambda *x: info_label.setter('height')(info_label, info_label.texture_size[1]))
-        card.add_widget(info_label)
+    def row_view_data(self, row_id, record, problems=()):
+        """Builds the RecycleView data entry for one record dict; problems from the validator add a line."""
+        info_text = (f"[b]用户:[/b] {record.get('用户名', '')} ([b]原资产号:[/b] {record.get('原表资产号', '')})\n"
+                     f"[b]新资产号:[/b] {record.get('新资产号', '')} | [b]铅封号:[/b] {record.get('铅封号', '')}")
+        if problems:
+            info_text += f"\n[color=d32f2f]{escape_markup('; '.join(problems))}[/color]"
+        return {'row_id': row_id, 'record': record, 'screen': self, 'info_text': info_text, 'problems': list(problems),
+                'height': self.ROW_HEIGHT + (dp(24) if problems else 0)}
 
-        btn_layout = BoxLayout(size_hint_y=None, height='40dp', spacing='10dp')
-        edit_btn = ThemedButton(text="修改")
-        edit_btn.bind(on_press=partial(self.show_edit_popup, index, row))
-        delete_btn = Button(text="删除", background_color=C["error"], background_normal='')
-        delete_btn.bind(on_press=partial(self.confirm_delete, index))
-        btn_layout.add_widget(edit_btn)
-        btn_layout.add_widget(delete_btn)
-        card.add_widget(btn_layout)
+    def count_duplicates(self, record, step):
+        for col, counts in self.dup_counts.items(): counts[str(record.get(col, '') or '').strip()] += step
+
+    def sharing_rows(self, *records):
+        """Row ids whose DUPLICATE_KEY_COLUMNS values match one of the records'; their duplicate counts change with them."""
+        values = {col: {str(record.get(col, '') or '').strip() for record in records} - {''} for col in self.dup_counts}
+        return {row_id for row_id, entry in self.rows.items()
+                if any(str(entry['record'].get(col, '') or '').strip() in found for col, found in values.items())}
+
+    def recheck(self, row_ids):
+        """Re-validates only row_ids against the day's duplicate counts and refreshes those rows."""
+        problems = self.validator.validate({row_id: self.rows[row_id]['record'] for row_id in row_ids}, self.dup_counts)
+        filter_changed = False
+        for row_id in row_ids:
+            entry = self.rows[row_id]
+            had_problems = bool(entry['problems'])
+            entry.update(self.row_view_data(row_id, entry['record'], problems.get(row_id, ())))
+            filter_changed |= had_problems != bool(entry['problems'])
+            if entry['problems']: self.problem_rows.add(row_id)
+            else: self.problem_rows.discard(row_id)
+        self.show_problem_count()
+        if self.only_problems and filter_changed: self.record_list.data = self.visible_rows()
+        else: self.record_list.refresh_from_data()
 
-        return card
+    def show_problem_count(self):
+        self.problem_label.text = f"校验: {len(self.problem_rows)} 条记录有问题" if self.problem_rows else "校验: 未发现问题"
+    def visible_rows(self):
+        return [entry for entry in self.rows.values() if entry['problems'] or not self.only_problems]
+
+    def filter_text(self):
+        return '显示全部' if self.only_problems else '只看有问题的'
+    def toggle_problem_filter(self, instance):
+        self.only_problems = not self.only_problems
+        self.filter_btn.text = self.filter_text()
+        if self.rows: self.record_list.data = self.visible_rows()
         
     def show_edit_popup(self, index, row, instance):
         content = BoxLayout(orientation='vertical', spacing='10dp', padding='10dp')
@@ -585,14 +913,14 @@ class EditScreen(Screen):
     def save_edit(self, index, inputs, popup):
         try:
             dm = App.get_running_app().data_manager
-            df = dm.load_daily_data()
-            
-            for field, widget in inputs.items():
-                df.loc[index, field] = widget.text
-                
-            dm.save_daily_data(df)
+            changes = {field: widget.text for field, widget in inputs.items()}
+            dm.update_record(index, changes)
             popup.dismiss()
-            self.populate_data()
+            # 只更新被修改的这一行, 不重新加载整张表
+            entry = self.rows[index]
+            old_record, entry['record'] = entry['record'], dict(entry['record'], **changes)
+            self.count_duplicates(old_record, -1); self.count_duplicates(entry['record'], 1)
+            self.recheck(self.sharing_rows(old_record, entry['record']) | {index})
             show_popup_global("成功", "数据修改已保存。")
         except Exception as e:
             show_popup_global("错误", f"保存修改失败: {e}")
@@ -617,22 +945,54 @@ class EditScreen(Screen):
     def delete_record(self, index, popup):
         try:
             dm = App.get_running_app().data_manager
-            df = dm.load_daily_data()
-            df = df.drop(index).reset_index(drop=True)
-            dm.save_daily_data(df)
+            dm.delete_record(index)
             popup.dismiss()
-            self.populate_data()
+            entry = self.rows.pop(index)
+            if entry['problems'] or not self.only_problems: self.record_list.data.remove(entry)
+            self.problem_rows.discard(index)
+            if not self.rows: self.populate_data()
+            else:
+                self.count_duplicates(entry['record'], -1)
+                self.recheck(self.sharing_rows(entry['record']))
             show_popup_global("成功", "记录已删除。")
         except Exception as e:
             show_popup_global("错误", f"删除记录失败: {e}")
 
 
+    def export_data(self, instance):
+        try:
+            app = App.get_running_app(); app.flush_writes()
+            output_file = app.data_manager.export()
+            show_popup_global("导出成功", f"当日数据已导出到:\n{output_file}")
+        except PermissionError: show_popup_global("导出错误", "无法写入文件！\n请检查应用权限或关闭已打开的Excel文件。")
+        except Exception as e: show_popup_global("导出错误", f"导出数据时发生错误: {e}")
+
+    def export_month(self, instance):
+        instance.disabled = True
+        threading.Thread(target=self.run_month_export, args=(instance,), daemon=True).start()
+    def run_month_export(self, button):
+        """Runs on a worker thread: only changed daily files are parsed, then the month is streamed to one workbook."""
+        app = App.get_running_app()
+        try:
+            app.flush_writes(); app.data_manager.compact()
+            app.archive.refresh()
+            output_file, count = app.archive.export_month()
+            title, message = "导出成功", f"本月 {count} 条记录已汇总到:\n{output_file}"
+        except PermissionError: title, message = "导出错误", "无法写入文件！\n请检查应用权限或关闭已打开的Excel文件。"
+        except Exception as e: title, message = "导出错误", f"汇总本月数据时发生错误: {e}"
+        Clock.schedule_once(lambda dt: (setattr(button, 'disabled', False), show_popup_global(title, message)))
+
     def back_to_main(self, instance):
         self.manager.current = 'main'
         
 class ExcelDataEntryApp(App):
     asset_db = ObjectProperty(None)
     data_manager = ObjectProperty(None)
+    write_queue = ObjectProperty(None)
+    archive = ObjectProperty(None)
+    sync_client = ObjectProperty(None)
+    daily_stats = ObjectProperty(None)
+    ledger_reloading = False
     
     def build(self):
         self.screen_manager = ScreenManager(transition=NoTransition())
@@ -641,5 +1001,89 @@ class ExcelDataEntryApp(App):
         self.screen_manager.add_widget(EditScreen(name='edit'))
         return self.screen_manager
 
+    def on_start(self):
+        Window.bind(on_flip=self.on_first_frame)
+
+    def on_first_frame(self, *args):
+        Window.unbind(on_flip=self.on_first_frame)
+        elapsed = time.perf_counter() - APP_STARTED
+        metrics.observe('ui.first_frame', elapsed)
+        self.screen_manager.get_screen('start').add_log(f"启动用时 {elapsed:.2f} 秒 (首帧)")
+
+    def flush_writes(self, timeout=10):
+        """Waits until every record handed to the write-behind queue is on disk."""
+        return self.write_queue.flush(timeout) if self.write_queue else True
+
+    def on_write_error(self, error, seqs):
+        # 由后台写入线程调用
+        if isinstance(error, PermissionError):
+            message = f"无法写入文件！\n请检查应用权限或关闭已打开的Excel文件。\n{len(seqs)} 条记录将在下次保存时重试。"
+        else:
+            message = f"保存数据时发生错误: {error}\n{len(seqs)} 条记录将在下次保存时重试。"
+        Clock.schedule_once(lambda dt: show_popup_global("保存错误", message))
+
+    def compact_data(self):
+        """Merges journaled records into today's xlsx so the file is complete on disk."""
+        if not self.data_manager: return
+        try:
+            self.flush_writes()
+            self.data_manager.compact()
+        except Exception as e:
+            show_popup_global("保存错误", f"合并当日数据文件时出错: {e}")
+
+    def reload_ledger(self, on_done):
+        """
+        Re-reads the changed ledger files on a thread and swaps in the updated
+        asset_db on the main thread; until then the current one keeps serving
+        lookups. on_done(message, error=None) runs on the main thread.
+        Returns False when a reload is already running.
+        """
+        if self.ledger_reloading: return False
+        self.ledger_reloading = True
+        asset_db, started = self.asset_db, time.time()
+        def run():
+            try:
+                new_db, counts = asset_db.reload()
+                new_db.search_keys()
+            except Exception as e:
+                message = f"更新台账时发生错误: {e}"
+                Clock.schedule_once(lambda dt: finish(None, None, message)); return
+            Clock.schedule_once(lambda dt: finish(new_db, counts))
+        def finish(new_db, counts, error=None):
+            self.ledger_reloading = False
+            if error: on_done("台账更新失败。", error); return
+            if new_db is asset_db: on_done("台账文件没有变化。"); return
+            # 期间若已重新加载了别的台账, 不再替换
+            if self.asset_db is asset_db: self.asset_db = new_db
+            on_done(f"台账已更新: 新增 {counts['added']} 条, 删除 {counts['removed']} 条, 修改 {counts['changed']} 条, "
+                    f"用时 {time.time() - started:.1f} 秒")
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def start_sync(self, url):
+        """Records every change of the new DataManager in the outbox and starts uploading it."""
+        if self.sync_client: self.sync_client.stop(timeout=5)
+        outbox = SyncOutbox(os.path.join(self.user_data_dir, 'sync'))
+        self.data_manager.listeners.append(outbox)
+        log = self.screen_manager.get_screen('start').add_log
+        self.sync_client = SyncClient(outbox, url, on_status=lambda message: Clock.schedule_once(lambda dt: log(message)))
+        self.sync_client.start()
+        log(f"数据同步已开启: {url} (待上传 {len(outbox.pending())} 条)")
+
+    def flush_metrics(self):
+        try: metrics.flush()
+        except OSError: traceback.print_exc()
+
+    def on_pause(self):
+        self.compact_data()
+        self.flush_metrics()
+        return True
+
+    def on_stop(self):
+        self.compact_data()
+        if self.write_queue: self.write_queue.close(timeout=10)
+        if self.sync_client: self.sync_client.stop(timeout=5)
+        self.flush_metrics()
+
 if __name__ == '__main__':
     ExcelDataEntryApp().run()
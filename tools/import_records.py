@@ -0,0 +1,173 @@
+"""
+Headless importer for swap records collected outside the app (no Kivy needed).
+
+    python tools/import_records.py --ledger 台账.xlsx swaps.csv
+    python tools/import_records.py --ledger a.xlsx --ledger b.xlsx#线路2 swaps.xlsx --dry-run
+
+The input is a CSV or xlsx whose header uses the daily-file column names
+(原表资产号, 新资产号, 铅封号, ...). Every 原表资产号 must be in the ledger;
+客户号/用户名/原表表码 are filled in from it when the input leaves them empty.
+Rows with a 录入时间 go to that day's 录入结果_YYYYMMDD.xlsx, the rest to today's.
+Accepted rows are appended with one write per day; rejected rows are written,
+with the reason, to <input>_rejects.csv.
+"""
+import argparse
+import csv
+import itertools
+import os
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import (  # noqa: E402
+    DATA_BACKEND, DATA_COLUMN_ORDER, AssetDatabase, DuplicateIndex, create_data_manager, parse_ledger_sources,
+)
+
+LEDGER_FILLED_COLUMNS = ('客户号', '用户名', '原表表码')
+TIME_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%Y/%m/%d %H:%M:%S', '%Y/%m/%d')
+
+
+def read_rows(path):
+    """Streams the input as dicts of stripped strings, one per non-empty row."""
+    if path.lower().endswith(('.xlsx', '.xlsm')):
+        import openpyxl
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(values_only=True)
+            header = [str(name).strip() if name is not None else '' for name in next(rows, ())]
+            for row in rows:
+                record = {name: '' if value is None else str(value).strip()
+                          for name, value in itertools.zip_longest(header, row) if name}
+                if any(record.values()): yield record
+        finally:
+            wb.close()
+        return
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for record in csv.DictReader(f):
+            record = {name.strip(): (value or '').strip() for name, value in record.items() if name}
+            if any(record.values()): yield record
+
+
+def entry_day(record):
+    """YYYYMMDD of the record's 录入时间, normalising the time to the app's format; None if unreadable."""
+    value = record.get('录入时间', '')
+    if not value:
+        record['录入时间'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return datetime.now().strftime('%Y%m%d')
+    for fmt in TIME_FORMATS:
+        try:
+            entered = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        record['录入时间'] = entered.strftime('%Y-%m-%d %H:%M:%S')
+        return entered.strftime('%Y%m%d')
+    return None
+
+
+class Importer:
+    """Validates records against the ledger and the daily files, collecting accepted rows per day."""
+    def __init__(self, asset_db, data_manager, installer=''):
+        self.asset_db = asset_db
+        self.data_manager = data_manager
+        self.installer = installer
+        self.accepted = {}  # day -> [record]
+        self.rejects = []   # (row number, record, reason)
+        # 本次导入中已接受的值, 同一文件中的重复行也要拒绝
+        self.seen = DuplicateIndex(data_manager.get_output_dir())
+
+    def ledger_record(self, asset):
+        # 按完整号码精确查找; 按后六位查短号码时会扫描整个台账
+        return next((self.asset_db.records[pos] for pos in self.asset_db.positions(asset)), None)
+
+    def check(self, record):
+        """Returns the reason to reject a record, or None after completing it from the ledger."""
+        asset = record.get('原表资产号', '')
+        if not asset: return '缺少原表资产号'
+        ledger = self.ledger_record(asset)
+        if ledger is None: return '台账中没有该原表资产号'
+        for col in LEDGER_FILLED_COLUMNS:
+            if not record.get(col): record[col] = str(ledger[col])
+        if not record.get('安装人员') and self.installer: record['安装人员'] = self.installer
+        duplicates = self.data_manager.find_duplicates(record)
+        if duplicates:
+            col, value, places = duplicates[0]
+            return f"重复: {col} {value} 已录入过 ({', '.join(places[:3])})"
+        duplicates = self.seen.find(record)
+        if duplicates:
+            col, value, _ = duplicates[0]
+            return f"重复: {col} {value} 在导入文件中出现多次"
+        return None
+
+    def add(self, row_number, record):
+        day = entry_day(record)
+        reason = '录入时间格式错误' if day is None else self.check(record)
+        if reason:
+            self.rejects.append((row_number, record, reason)); return
+        record = {col: record.get(col, '') for col in DATA_COLUMN_ORDER}
+        self.seen.add(record)
+        self.accepted.setdefault(day, []).append(record)
+
+    def commit(self):
+        """Appends the accepted rows, one write per daily file. Returns the files written."""
+        written = []
+        for day, records in sorted(self.accepted.items()):
+            self.data_manager.append_to_day(day, records)
+            written.append((self.data_manager.get_output_path(day), len(records)))
+        self.data_manager.compact()
+        return written
+
+    def write_rejects(self, path, columns):
+        with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+            writer = csv.writer(f)
+            writer.writerow(['行号', '拒绝原因'] + columns)
+            for row_number, record, reason in self.rejects:
+                writer.writerow([row_number, reason] + [record.get(col, '') for col in columns])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='CSV or xlsx of records to import')
+    parser.add_argument('--ledger', action='append', required=True,
+                        help="ledger file, 'path#工作表' or 'path#*'; repeat for several ledgers")
+    parser.add_argument('--output-dir', help='folder of the 录入结果_YYYYMMDD.xlsx files (default: Downloads)')
+    parser.add_argument('--backend', default=DATA_BACKEND, choices=('xlsx', 'journal', 'sqlite'))
+    parser.add_argument('--data-dir', default=os.path.expanduser('~/.cdgj'), help='app data folder (SQLite database)')
+    parser.add_argument('--cache-dir', default=os.path.expanduser('~/.cdgj/ledger_cache'), help='parsed ledger cache')
+    parser.add_argument('--installer', default='', help='安装人员 for rows that leave it empty')
+    parser.add_argument('--rejects', help='reject report path (default: <input>_rejects.csv)')
+    parser.add_argument('--dry-run', action='store_true', help='validate only, write nothing but the reject report')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    asset_db = AssetDatabase(parse_ledger_sources(';'.join(args.ledger)), cache_dir=args.cache_dir)
+    print(f"ledger: {len(asset_db.records)} rows from {len(asset_db.sources)} source(s) "
+          f"({'cache' if asset_db.from_cache else 'parsed'}, {time.perf_counter() - started:.1f}s)")
+    data_manager = create_data_manager(args.data_dir, backend=args.backend, output_dir=args.output_dir)
+    importer = Importer(asset_db, data_manager, args.installer)
+
+    started = time.perf_counter()
+    columns = list(DATA_COLUMN_ORDER)
+    for row_number, record in enumerate(read_rows(args.input), 2):
+        columns.extend(col for col in record if col not in columns)
+        importer.add(row_number, record)
+    accepted = sum(len(records) for records in importer.accepted.values())
+    print(f"checked {accepted + len(importer.rejects)} rows in {time.perf_counter() - started:.1f}s: "
+          f"{accepted} accepted, {len(importer.rejects)} rejected")
+
+    if importer.rejects:
+        rejects_path = args.rejects or os.path.splitext(args.input)[0] + '_rejects.csv'
+        importer.write_rejects(rejects_path, columns)
+        print(f'rejects written to {rejects_path}')
+    if args.dry_run or not accepted: return 0 if not importer.rejects else 1
+    started = time.perf_counter()
+    for output_file, count in importer.commit():
+        print(f'  {count} rows -> {output_file}')
+    print(f'appended in {time.perf_counter() - started:.1f}s')
+    return 0 if not importer.rejects else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
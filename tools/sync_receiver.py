@@ -0,0 +1,124 @@
+"""
+Reference receiver for the app's record sync (standard library only).
+
+    python tools/sync_receiver.py --port 8765 --db received.sqlite3
+    CDGJ_SYNC_URL=http://127.0.0.1:8765/sync python main.py
+
+POST /sync takes one batch from SyncClient:
+    {"device": ..., "first_seq": n, "last_seq": m,
+     "changes": [{"op": "upsert", "uid": ..., "day": "YYYYMMDD", "record": {...}},
+                 {"op": "delete", "uid": ..., "day": "YYYYMMDD"}]}
+and answers {"ok": true, "acked": m}. Records are keyed by uid, so a batch
+that is sent again after a lost reply changes nothing. GET /status returns
+the record counts per device and day; --export writes them to one xlsx.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import DATA_COLUMN_ORDER, XlsxWriter  # noqa: E402
+
+
+class Store:
+    """The received records in SQLite, one row per uid."""
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS records (uid TEXT PRIMARY KEY, device TEXT NOT NULL, '
+                              'day TEXT NOT NULL, record TEXT NOT NULL, updated_at TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS devices (device TEXT PRIMARY KEY, last_seq INTEGER NOT NULL, '
+                              'seen_at TEXT NOT NULL)')
+
+    def apply(self, batch):
+        device, last_seq = str(batch['device']), int(batch['last_seq'])
+        now = datetime.now().isoformat(timespec='seconds')
+        with self.lock, self.conn:
+            for change in batch['changes']:
+                if change['op'] == 'delete':
+                    self.conn.execute('DELETE FROM records WHERE uid = ?', (change['uid'],))
+                elif change['op'] == 'upsert':
+                    self.conn.execute(
+                        'INSERT INTO records (uid, device, day, record, updated_at) VALUES (?, ?, ?, ?, ?) '
+                        'ON CONFLICT(uid) DO UPDATE SET day = excluded.day, record = excluded.record, updated_at = excluded.updated_at',
+                        (change['uid'], device, change['day'], json.dumps(change['record'], ensure_ascii=False), now))
+                else:
+                    raise ValueError(f"unknown op: {change['op']}")
+            self.conn.execute('INSERT INTO devices (device, last_seq, seen_at) VALUES (?, ?, ?) '
+                              'ON CONFLICT(device) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq), seen_at = excluded.seen_at',
+                              (device, last_seq, now))
+        return last_seq
+
+    def status(self):
+        with self.lock:
+            counts = self.conn.execute('SELECT device, day, COUNT(*) FROM records GROUP BY device, day ORDER BY device, day').fetchall()
+            devices = self.conn.execute('SELECT device, last_seq, seen_at FROM devices ORDER BY device').fetchall()
+        return {'devices': [{'device': d, 'last_seq': seq, 'seen_at': seen} for d, seq, seen in devices],
+                'records': [{'device': d, 'day': day, 'count': n} for d, day, n in counts]}
+
+    def export(self, path):
+        """Writes every record, ordered by day, to one workbook (streamed through XlsxWriter, like the daily files)."""
+        with self.lock:
+            rows = self.conn.execute('SELECT device, day, record FROM records ORDER BY day, updated_at').fetchall()
+        with XlsxWriter(path, ['设备', '日期'] + DATA_COLUMN_ORDER, sheet='汇总') as writer:
+            for device, day, record in rows:
+                writer.append(dict(json.loads(record), 设备=device, 日期=day))
+        return len(rows)
+
+
+class Handler(BaseHTTPRequestHandler):
+    store = None
+
+    def reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/sync': return self.reply(404, {'ok': False, 'error': 'not found'})
+        try:
+            batch = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8'))
+            acked = self.store.apply(batch)
+        except (ValueError, KeyError, TypeError) as e:
+            return self.reply(400, {'ok': False, 'error': str(e)})
+        self.reply(200, {'ok': True, 'acked': acked, 'applied': len(batch['changes'])})
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/status': return self.reply(404, {'ok': False, 'error': 'not found'})
+        self.reply(200, dict(self.store.status(), ok=True))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--db', default='received.sqlite3')
+    parser.add_argument('--export', help='write all received records to this xlsx and exit')
+    args = parser.parse_args(argv)
+    Handler.store = Store(args.db)
+    if args.export:
+        print(f'{Handler.store.export(args.export)} records written to {args.export}')
+        return
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'listening on http://{args.host}:{args.port}/sync (Ctrl+C to stop)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Checks recorded swaps over a range of days in one pass (no Kivy needed).
+
+    python tools/validate_records.py --ledger 台账.xlsx --start 20261001 --end 20261031
+    python tools/validate_records.py --ledger a.xlsx --ledger b.xlsx#线路2 --report problems.csv
+
+The 录入结果_YYYYMMDD.xlsx files in the range are checked together, so a 新资产号
+or 铅封号 used on two different days is reported as well. Format rules come from
+validation_rules.json in the output folder when it exists. Problem rows are
+written, with their day and row number, to the report CSV.
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from core import (  # noqa: E402
+    DATA_BACKEND, DATA_COLUMN_ORDER, AssetDatabase, DailyArchive, RecordValidator, create_data_manager, parse_ledger_sources,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ledger', action='append', help="ledger file, 'path#工作表' or 'path#*'; repeat for several ledgers")
+    parser.add_argument('--start', help='first day, YYYYMMDD (default: the earliest file)')
+    parser.add_argument('--end', help='last day, YYYYMMDD (default: today)')
+    parser.add_argument('--output-dir', help='folder of the 录入结果_YYYYMMDD.xlsx files (default: Downloads)')
+    parser.add_argument('--backend', default=DATA_BACKEND, choices=('xlsx', 'journal', 'sqlite'))
+    parser.add_argument('--data-dir', default=os.path.expanduser('~/.cdgj'), help='app data folder (SQLite database)')
+    parser.add_argument('--cache-dir', default=os.path.expanduser('~/.cdgj'), help='parsed ledger and archive caches')
+    parser.add_argument('--report', default='validation_report.csv', help='problem rows are written here')
+    args = parser.parse_args(argv)
+
+    asset_db = None
+    if args.ledger:
+        started = time.perf_counter()
+        asset_db = AssetDatabase(parse_ledger_sources(';'.join(args.ledger)), cache_dir=os.path.join(args.cache_dir, 'ledger_cache'))
+        print(f'ledger: {len(asset_db.records)} rows ({time.perf_counter() - started:.1f}s)')
+    else:
+        print('no --ledger given: ledger and 原表表码 checks are skipped')
+    data_manager = create_data_manager(args.data_dir, backend=args.backend, output_dir=args.output_dir)
+    archive = DailyArchive(data_manager, os.path.join(args.cache_dir, 'archive_cache'))
+    archive.refresh()
+    days = archive.days(args.start, args.end)
+
+    started = time.perf_counter()
+    validator = RecordValidator(asset_db, RecordValidator.load_rules(data_manager.get_output_dir()))
+    problems = validator.validate_days(archive, args.start, args.end)
+    checked = sum(archive.summary(day)['count'] for day in days)
+    print(f'checked {checked} rows from {len(days)} day(s) in {time.perf_counter() - started:.1f}s: '
+          f'{len(problems)} with problems')
+    if not problems: return 0
+
+    with open(args.report, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['日期', '行号', '问题'] + DATA_COLUMN_ORDER)
+        rows = {}
+        for (day, pos), found in problems.items():
+            if day not in rows: rows[day] = archive.rows(day)
+            # 行号与 Excel 中一致: 第1行是表头
+            writer.writerow([day, pos + 2, '; '.join(found)] + list(rows[day][pos]))
+    print(f'report written to {args.report}')
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())